@@ -1,9 +1,20 @@
 import os
 import re
-from typing import Dict, Any, List, Tuple
+import time
+import hashlib
+import heapq
+import json
+import operator
+import threading
+from typing import Dict, Any, List, Tuple, Optional
 from datetime import datetime
 import math
-from collections import Counter
+from collections import Counter, OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
@@ -22,17 +33,25 @@ except ImportError:
 
 # --- Configuration Management ---
 # Use the centralized config manager
-from modules.config_manager import load_config as load_app_config
+from modules.config_manager import load_config as load_app_config, ANN_INDEX_PATH, QUERY_EMBEDDING_CACHE_PATH, DEFAULT_EMBEDDING_MODEL
 
 # Global variable to hold configuration
 app_config = None
+# BM25 index over the configured snippets, rebuilt when the snippets change
+_snippet_index = None
+# Normalized embedding matrix over the configured snippets, same lifecycle
+_snippet_embeddings = None
+# OpenAIEmbeddings client, reused while the configured model stays the same
+_embedding_model = None
 
 def load_config(path: str = None):
     """
     Loads configuration from the centralized config manager.
     """
-    global app_config
+    global app_config, _snippet_index, _snippet_embeddings
     app_config = load_app_config()
+    _snippet_index = SnippetIndex(app_config.snippets)
+    _snippet_embeddings = SnippetEmbeddings(app_config.snippets, *_ann_settings(app_config))
 
     # Update based on environment variables
     if "OPENAI_API_KEY" in os.environ and not app_config.ai.offline_demo_mode:
@@ -65,12 +84,18 @@ def _get_openai_client() -> OpenAI | None:
         return None
 
 def _get_embedding_model():
-    """Returns the configured OpenAI embedding model."""
+    """Returns the configured OpenAI embedding model, constructed once per model name."""
+    global _embedding_model
     cfg = get_config()
     if not OPENAI_AVAILABLE or cfg.ai.offline_demo_mode:
         return None
+    # Must match the model config_manager embeds snippets with, or the vectors are not comparable
+    model = getattr(cfg.ai, 'embedding_model', None) or DEFAULT_EMBEDDING_MODEL
+    if _embedding_model is not None and getattr(_embedding_model, "model", None) == model:
+        return _embedding_model
     try:
-        return OpenAIEmbeddings(model="text-embedding-3-small")
+        _embedding_model = OpenAIEmbeddings(model=model)
+        return _embedding_model
     except Exception as e:
         print(f"Error initializing OpenAI Embeddings: {e}")
         return None
@@ -153,10 +178,219 @@ def bm25_similarity(query: str, document: str, k1: float = 1.2, b: float = 0.75,
 
     return max(score, 0.0)  # Ensure non-negative
 
+_TOKEN_RE = re.compile(r"[a-zA-Z0-9]+")
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+def _snippet_field(snippet, key: str) -> str:
+    """Read a field from a snippet dict or a config_manager.Snippet"""
+    if isinstance(snippet, dict):
+        return snippet.get(key, "") or ""
+    return getattr(snippet, key, "") or ""
+
+class SnippetIndex:
+    """
+    Inverted BM25 index over snippets, built once per snippet set. Name+description
+    and SQL are indexed as separate fields with corpus stats taken over the whole
+    snippet, so scores match bm25_similarity() as pick_most_related used to call it;
+    a query only touches the postings of its own terms.
+    """
+
+    # Name/description matches weigh more since they are closer to user intent
+    FIELD_WEIGHTS = (1.5, 1.0)
+
+    def __init__(self, snippets, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.keys = [self._key(s) for s in snippets]
+        self.total_docs = len(self.keys)
+        # postings[field][term] -> [(doc_id, tf)]; field_lens[field][doc_id] -> token count
+        self.postings: Tuple[Dict[str, List[Tuple[int, int]]], ...] = ({}, {})
+        self.field_lens: Tuple[List[int], ...] = ([], [])
+
+        doc_freq = Counter()
+        total_len = 0
+        for doc_id, (name, description, sql) in enumerate(self.keys):
+            fields = (_tokens(f"{name} {description}"), _tokens(sql))
+            total_len += sum(len(terms) for terms in fields)
+            doc_freq.update(set(fields[0]) | set(fields[1]))
+            for field, terms in enumerate(fields):
+                self.field_lens[field].append(len(terms))
+                for term, tf in Counter(terms).items():
+                    self.postings[field].setdefault(term, []).append((doc_id, tf))
+
+        self.avg_doc_len = total_len / self.total_docs if self.total_docs and total_len else 50
+        self.idf = {term: math.log((self.total_docs + 1) / (df + 1)) + 1.0 for term, df in doc_freq.items()}
+
+    @staticmethod
+    def _key(snippet) -> Tuple[str, str, str]:
+        return (_snippet_field(snippet, "name"), _snippet_field(snippet, "description"), _snippet_field(snippet, "sql"))
+
+    def matches(self, snippets) -> bool:
+        """True if built from these snippets (cheap: the strings are usually the same objects)"""
+        return len(snippets) == self.total_docs and all(self._key(s) == k for s, k in zip(snippets, self.keys))
+
+    def field_scores(self, query: str) -> Dict[int, Tuple[float, float]]:
+        """(name+description, SQL) BM25 scores for each snippet sharing a term with `query`"""
+        query_terms = set(_tokens(query))
+        if not query_terms:
+            return {}
+        k1, b, n = self.k1, self.b, len(query_terms)
+        per_field = []
+        for field in range(2):
+            acc: Dict[int, float] = {}
+            matched = Counter()
+            lens = self.field_lens[field]
+            for term in query_terms:
+                postings = self.postings[field].get(term)
+                if not postings:
+                    continue
+                idf = self.idf[term]
+                for doc_id, tf in postings:
+                    tf_component = (tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (lens[doc_id] / self.avg_doc_len)))
+                    acc[doc_id] = acc.get(doc_id, 0.0) + idf * tf_component
+                    matched[doc_id] += 1
+            # Same normalization as bm25_similarity: average over query terms, boosted by coverage
+            per_field.append({d: score / n * (0.5 + 0.5 * matched[d] / n) for d, score in acc.items()})
+        return {d: (per_field[0].get(d, 0.0), per_field[1].get(d, 0.0)) for d in per_field[0].keys() | per_field[1].keys()}
+
+    def top(self, query: str, k: int = 3) -> List[Tuple[int, float]]:
+        """
+        Best k (doc_id, score) pairs. Ties, including snippets that match nothing,
+        keep snippet order, as a stable sort over every snippet would.
+        """
+        w_name, w_sql = self.FIELD_WEIGHTS
+        scored = sorted(((-(w_name * name + w_sql * sql), d) for d, (name, sql) in self.field_scores(query).items()))
+        ranked = [(d, -neg) for neg, d in scored[:k]]
+        if len(ranked) < k:
+            seen = {d for d, _ in ranked}
+            ranked += [(d, 0.0) for d in range(self.total_docs) if d not in seen][:k - len(ranked)]
+        return ranked
+
+def get_snippet_index(snippets) -> SnippetIndex:
+    """The shared index, rebuilt only when `snippets` differ from what it was built from"""
+    global _snippet_index
+    if _snippet_index is None or not _snippet_index.matches(snippets):
+        _snippet_index = SnippetIndex(snippets)
+    return _snippet_index
+
+_QUERY_SPACE_RE = re.compile(r"\s+")
+
+def normalize_query(text: str) -> str:
+    """Case, whitespace and trailing punctuation do not change what a question asks"""
+    return _QUERY_SPACE_RE.sub(" ", text.lower()).strip().rstrip("?!.。 ")
+
+class QueryEmbeddingCache:
+    """
+    LRU of query embeddings keyed by (model, normalized question), backed by an
+    append-only JSON-lines file so repeat questions skip the embedding call across
+    restarts too. The file is replayed into the LRU on first use and rewritten with
+    just the live entries once it holds twice as many lines as the LRU can.
+    """
+
+    MAX_ENTRIES = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2000"))
+
+    def __init__(self, path: str = QUERY_EMBEDDING_CACHE_PATH, max_entries: int = None):
+        self.path = path
+        self.max_entries = self.MAX_ENTRIES if max_entries is None else max_entries
+        self._entries: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._lines = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _load(self):
+        self._loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # A torn last line from an interrupted write
+                    self._lines += 1
+                    key = (entry["model"], entry["text"])
+                    self._entries.pop(key, None)
+                    self._entries[key] = entry["embedding"]
+                    if len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+        except Exception as e:
+            print(f"Warning: Could not read query embedding cache {self.path}: {e}")
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        if not self.enabled:
+            return None
+        key = (model, normalize_query(text))
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, model: str, text: str, embedding: List[float]):
+        if not self.enabled or not embedding:
+            return
+        key = (model, normalize_query(text))
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            self._entries.pop(key, None)
+            self._entries[key] = embedding
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self.path:
+                try:
+                    self._append(key, embedding)
+                except Exception as e:
+                    print(f"Warning: Could not write query embedding cache {self.path}: {e}")
+
+    def _append(self, key: Tuple[str, str], embedding: List[float]):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if self._lines >= 2 * self.max_entries:
+            tmp = f"{self.path}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                for (model, text), vec in self._entries.items():
+                    f.write(json.dumps({"model": model, "text": text, "embedding": vec}, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
+            self._lines = len(self._entries)
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"model": key[0], "text": key[1], "embedding": embedding}, ensure_ascii=False) + "\n")
+        self._lines += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+query_embedding_cache = QueryEmbeddingCache()
+
 def calculate_embedding(text: str, embedding_model) -> List[float] | None:
-    """Calculates embedding for a given text using the provided model."""
+    """Calculates embedding for a given text using the provided model, via query_embedding_cache."""
     if not embedding_model:
         return None
+    model_name = getattr(embedding_model, "model", None) or type(embedding_model).__name__
+    cached = query_embedding_cache.get(model_name, text)
+    if cached is not None:
+        return cached
     try:
         # The OpenAIEmbeddings object from langchain might not directly expose an embed_query method
         # that returns a list of floats in a straightforward way for raw embedding calculation.
@@ -166,7 +400,9 @@ def calculate_embedding(text: str, embedding_model) -> List[float] | None:
         # or assume it has a compatible interface.
         # A common way is to use `embed_query` or similar.
         # Let's assume `embed_query` returns a list of floats.
-        return embedding_model.embed_query(text)
+        embedding = embedding_model.embed_query(text)
+        query_embedding_cache.put(model_name, text, embedding)
+        return embedding
     except Exception as e:
         print(f"Error calculating embedding for text: '{text[:50]}...': {e}")
         return None
@@ -182,11 +418,383 @@ def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
         return 0.0
     return dot_product / (norm_vec1 * norm_vec2)
 
+def _snippet_embedding(snippet) -> Optional[List[float]]:
+    """Read the embedding from a snippet dict or a config_manager.Snippet"""
+    if isinstance(snippet, dict):
+        return snippet.get("embedding")
+    return getattr(snippet, "embedding", None)
+
+class IVFIndex:
+    """
+    Inverted-file ANN index over unit vectors: spherical k-means splits the rows
+    into ~4*sqrt(n) lists and a query only scores the rows of its `nprobe` closest
+    centroids. Centroids and per-row list assignments (keyed by a hash of the
+    snippet's embedding-cache key) are persisted next to the embedding cache;
+    the vectors themselves are not, since the embedding cache already holds them.
+    On open, known rows reuse their stored list and new rows are inserted into
+    their nearest list, so adding snippets never retrains. The embedding model is
+    saved too, since vectors from another model cannot reuse the centroids.
+    """
+
+    # Embedded snippets needed before an enabled index (AIConfig.use_ann_index) is used
+    MIN_SNIPPETS = int(os.getenv("SNIPPET_ANN_MIN_SNIPPETS", "5000"))
+    NPROBE = int(os.getenv("SNIPPET_ANN_NPROBE", "16"))
+    # Retrain once the library outgrows the centroids by this factor
+    RETRAIN_GROWTH = 4.0
+    KMEANS_ITERS = 10
+
+    def __init__(self, centroids, vectors, keys: List[str], assign, trained_size: int, model: str = ""):
+        self.centroids = centroids
+        self.vectors = vectors
+        self.keys = list(keys)
+        self.assign = assign
+        self.trained_size = trained_size
+        self.model = model
+        self._rebuild_lists()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @staticmethod
+    def key_hash(key: str) -> str:
+        return hashlib.md5(key.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def train(cls, vectors, keys: List[str], nlist: int = None, seed: int = 0, model: str = "") -> "IVFIndex":
+        """Spherical k-means over (a sample of) `vectors`, which must be unit rows"""
+        n = len(vectors)
+        nlist = max(1, min(n, nlist or int(round(4 * math.sqrt(n)))))
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(n, size=min(n, nlist * 32), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(cls.KMEANS_ITERS):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            members = np.zeros((nlist, len(sample)), dtype=np.float32)
+            members[assign, np.arange(len(sample))] = 1.0
+            sums = members @ sample
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # An empty list keeps its old centroid
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids).astype(np.float32)
+        index = cls(centroids, vectors, keys, np.zeros(0, dtype=np.int32), trained_size=n, model=model)
+        index.assign = index._nearest(vectors)
+        index._rebuild_lists()
+        return index
+
+    def _nearest(self, vectors):
+        """List id for each row, in chunks so the score block stays small"""
+        out = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), 4096):
+            out[start:start + 4096] = np.argmax(vectors[start:start + 4096] @ self.centroids.T, axis=1)
+        return out
+
+    def _rebuild_lists(self):
+        order = np.argsort(self.assign, kind="stable").astype(np.int32)
+        bounds = np.cumsum(np.bincount(self.assign, minlength=len(self.centroids)))[:-1]
+        self.lists = np.split(order, bounds)
+
+    def search(self, query, k: int = 3, nprobe: int = None) -> List[Tuple[int, float]]:
+        """Best k (row, score) pairs for a unit `query`; ties keep row order"""
+        nprobe = min(len(self.centroids), nprobe or self.NPROBE)
+        probes = np.argsort(-(self.centroids @ query))[:nprobe]
+        rows = np.sort(np.concatenate([self.lists[p] for p in probes]))
+        if len(rows) < k:
+            rows = np.arange(len(self.keys))
+        sims = self.vectors[rows] @ query
+        best = np.arange(len(rows))
+        if k < len(rows):
+            best = np.argpartition(-sims, k - 1)[:k]
+        best = best[np.lexsort((best, -sims[best]))]
+        return [(int(rows[i]), float(sims[i])) for i in best]
+
+    def save(self, path: str = ANN_INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, centroids=self.centroids, assign=self.assign,
+                     keys=np.array([self.key_hash(k) for k in self.keys]),
+                     trained_size=np.int64(self.trained_size), model=np.array(self.model))
+        os.replace(tmp, path)
+
+    @classmethod
+    def open(cls, vectors, keys: List[str], path: str = ANN_INDEX_PATH, model: str = "") -> "IVFIndex":
+        """
+        Load the persisted index for these rows, inserting rows it has not seen and
+        dropping ones that are gone; retrain if missing, stale or for another model.
+        """
+        index = None
+        try:
+            with np.load(path) as saved:
+                centroids, trained_size = saved["centroids"], int(saved["trained_size"])
+                known = dict(zip(saved["keys"].tolist(), saved["assign"].tolist()))
+                # Indexes saved before the model was recorded count as another model
+                saved_model = str(saved["model"]) if "model" in saved.files else None
+            if (saved_model == model and centroids.shape[1] == vectors.shape[1]
+                    and len(keys) <= cls.RETRAIN_GROWTH * trained_size):
+                assign = np.array([known.get(cls.key_hash(k), -1) for k in keys], dtype=np.int32)
+                new_rows = np.flatnonzero(assign < 0)
+                index = cls(centroids, vectors, keys, np.zeros(0, dtype=np.int32), trained_size, model)
+                if len(new_rows):
+                    assign[new_rows] = index._nearest(vectors[new_rows])
+                index.assign = assign
+                index._rebuild_lists()
+                if len(new_rows) or len(known) != len(keys):
+                    print(f"🧭 ANN index: inserted {len(new_rows)} new snippets into {len(centroids)} lists")
+                    index.save(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Warning: Ignoring unreadable ANN index {path}: {e}")
+
+        if index is None:
+            start = time.perf_counter()
+            index = cls.train(vectors, keys, model=model)
+            print(f"🧭 ANN index: trained {len(index.centroids)} lists over {len(keys)} snippets in {time.perf_counter() - start:.2f}s")
+            index.save(path)
+        return index
+
+class SnippetEmbeddings:
+    """
+    Snippet embeddings as one L2-normalized float32 matrix, built once per snippet
+    set, so cosine scores for a query are a single matrix-vector product. Rows for
+    embeddings that cannot be compared (zero norm, or a dimension other than the
+    most common one) are left at zero and score 0.0, as cosine_similarity() does.
+    Without NumPy it falls back to cosine_similarity() over the raw lists.
+    """
+
+    def __init__(self, snippets, use_ann: bool = False, model: str = DEFAULT_EMBEDDING_MODEL):
+        self.keys = [SnippetIndex._key(s) for s in snippets]
+        self.vectors = [_snippet_embedding(s) for s in snippets]
+        self._fingerprint = self.fingerprint(snippets)
+        # Snippet positions that have an embedding; matrix row i belongs to doc_ids[i]
+        self.doc_ids = [d for d, vec in enumerate(self.vectors) if vec]
+        self.rows = {d: row for row, d in enumerate(self.doc_ids)}
+        self.dim = Counter(len(self.vectors[d]) for d in self.doc_ids).most_common(1)[0][0] if self.doc_ids else 0
+        self.matrix = None
+
+        if np is not None and self.doc_ids:
+            self.matrix = np.zeros((len(self.doc_ids), self.dim), dtype=np.float32)
+            for row, d in enumerate(self.doc_ids):
+                if len(self.vectors[d]) == self.dim:
+                    self.matrix[row] = self.vectors[d]
+            norms = np.linalg.norm(self.matrix, axis=1, keepdims=True)
+            np.divide(self.matrix, norms, out=self.matrix, where=norms > 0)
+
+        # With use_ann, large libraries search an IVF index instead of scoring every row
+        self.settings = (use_ann, model)
+        self.ann = None
+        if use_ann and self.matrix is not None and len(self.doc_ids) >= IVFIndex.MIN_SNIPPETS:
+            row_keys = [f"{name}::{sql}::{description}" for name, description, sql in (self.keys[d] for d in self.doc_ids)]
+            self.ann = IVFIndex.open(self.matrix, row_keys, model=model)
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    @staticmethod
+    def fingerprint(snippets) -> int:
+        """
+        Cheap identity for a snippet set: text keys plus each embedding's length and
+        end values, so a re-embedded snippet changes it without comparing whole vectors
+        """
+        parts = []
+        for s in snippets:
+            vec = _snippet_embedding(s)
+            parts.append((SnippetIndex._key(s), (len(vec), vec[0], vec[-1]) if vec else None))
+        return hash(tuple(parts))
+
+    @staticmethod
+    def _fast_view(snippets):
+        """(keys, embeddings) pulled out with C-level getters, or None for mixed/partial snippets"""
+        try:
+            if isinstance(snippets[0], dict):
+                keys, vecs = operator.itemgetter("name", "description", "sql"), operator.itemgetter("embedding")
+            else:
+                keys, vecs = operator.attrgetter("name", "description", "sql"), operator.attrgetter("embedding")
+            return list(map(keys, snippets)), list(map(vecs, snippets))
+        except (KeyError, AttributeError, TypeError, IndexError):
+            return None
+
+    def matches(self, snippets) -> bool:
+        """
+        True if built from these snippets. Same keys and the very same embedding lists
+        is the fast path; otherwise fingerprint() decides, and on a match the caller's
+        lists are adopted so the next call with them takes the fast path.
+        """
+        if len(snippets) != len(self.keys):
+            return False
+        view = self._fast_view(snippets)
+        if view is not None and view[0] == self.keys and all(map(operator.is_, view[1], self.vectors)):
+            return True
+        if self.fingerprint(snippets) != self._fingerprint:
+            return False
+        self.vectors = view[1] if view is not None else [_snippet_embedding(s) for s in snippets]
+        return True
+
+    def _unit_query(self, query_embedding):
+        """`query_embedding` as a unit float32 vector, or None if it cannot match any row"""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        if query.shape != (self.dim,):
+            print(f"⚠️  Query embedding has shape {query.shape} but snippet embeddings have {self.dim} dims; "
+                  "were they made with a different embedding model?")
+            return None
+        norm = float(np.linalg.norm(query))
+        return query / norm if norm > 0 else None
+
+    def scores(self, query_embedding: List[float]) -> List[float]:
+        """Cosine similarity of `query_embedding` against every embedded snippet, in doc_ids order"""
+        if self.matrix is None:
+            return [cosine_similarity(query_embedding, self.vectors[d]) for d in self.doc_ids]
+        query = self._unit_query(query_embedding)
+        return [0.0] * len(self.doc_ids) if query is None else (self.matrix @ query).tolist()
+
+    def score_docs(self, query_embedding: List[float], doc_ids) -> Dict[int, float]:
+        """Cosine similarity for just these snippets; ones without an embedding are omitted"""
+        rows = [self.rows[d] for d in doc_ids if d in self.rows]
+        if not rows:
+            return {}
+        if self.matrix is None:
+            return {self.doc_ids[r]: cosine_similarity(query_embedding, self.vectors[self.doc_ids[r]]) for r in rows}
+        query = self._unit_query(query_embedding)
+        sims = [0.0] * len(rows) if query is None else (self.matrix[rows] @ query).tolist()
+        return {self.doc_ids[r]: sim for r, sim in zip(rows, sims)}
+
+    def top(self, query_embedding: List[float], k: int = 3, exact: bool = False) -> List[Tuple[int, float]]:
+        """Best k (doc_id, score) pairs; ties keep snippet order. `exact` bypasses the ANN index."""
+        if not self.doc_ids or k <= 0:
+            return []
+        if self.matrix is None:
+            scored = sorted(zip(self.scores(query_embedding), self.doc_ids), key=lambda x: -x[0])
+            return [(d, score) for score, d in scored[:k]]
+
+        query = self._unit_query(query_embedding)
+        if query is None:
+            return [(d, 0.0) for d in self.doc_ids[:k]]
+        if self.ann is not None and not exact:
+            return [(self.doc_ids[row], score) for row, score in self.ann.search(query, k)]
+        sims = self.matrix @ query
+        rows = np.arange(len(sims))
+        if k < len(sims):
+            # Partition around the k-th best, then order just those rows; np.lexsort
+            # sorts by the last key first, so ties fall back to row (= snippet) order
+            rows = np.argpartition(-sims, k - 1)[:k]
+        rows = rows[np.lexsort((rows, -sims[rows]))]
+        return [(self.doc_ids[row], float(sims[row])) for row in rows]
+
+def _percentile_ms(seconds: List[float], pct: float) -> float:
+    ordered = sorted(seconds)
+    return round(ordered[max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))] * 1000, 4)
+
+def benchmark_ann(vectors=None, n: int = 20000, dim: int = 1536, queries: int = 200, k: int = 3,
+                  nprobes=(1, 2, 4, 8, 16, 32), seed: int = 0) -> Dict[str, Any]:
+    """
+    Recall@k and latency of IVFIndex against exact matrix search. Uses `vectors`
+    (e.g. the configured snippet embeddings) or n synthetic clustered ones; queries
+    are noisy copies of random rows, which is how paraphrased questions behave.
+    """
+    rng = np.random.default_rng(seed)
+    if vectors is None:
+        centers = rng.standard_normal((max(1, n // 100), dim)).astype(np.float32)
+        vectors = centers[rng.integers(0, len(centers), n)] + 0.7 * rng.standard_normal((n, dim)).astype(np.float32)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    probes = vectors[rng.integers(0, len(vectors), queries)] + 0.5 * rng.standard_normal((queries, vectors.shape[1])).astype(np.float32)
+    probes /= np.linalg.norm(probes, axis=1, keepdims=True)
+
+    exact, exact_times = [], []
+    for q in probes:
+        start = time.perf_counter()
+        sims = vectors @ q
+        best = np.argpartition(-sims, k - 1)[:k] if k < len(sims) else np.arange(len(sims))
+        exact_times.append(time.perf_counter() - start)
+        exact.append(set(best.tolist()))
+
+    start = time.perf_counter()
+    index = IVFIndex.train(vectors, [str(i) for i in range(len(vectors))], seed=seed)
+    report = {
+        "snippets": len(vectors),
+        "dim": int(vectors.shape[1]),
+        "k": k,
+        "lists": len(index.centroids),
+        "build_seconds": round(time.perf_counter() - start, 3),
+        "exact": {"p50_ms": _percentile_ms(exact_times, 50), "p95_ms": _percentile_ms(exact_times, 95)},
+        "ivf": [],
+    }
+    for nprobe in nprobes:
+        if nprobe > len(index.centroids):
+            continue
+        hits, times = 0, []
+        for q, truth in zip(probes, exact):
+            start = time.perf_counter()
+            found = index.search(q, k, nprobe=nprobe)
+            times.append(time.perf_counter() - start)
+            hits += len(truth & {row for row, _ in found})
+        report["ivf"].append({
+            "nprobe": nprobe,
+            "recall": round(hits / (len(probes) * min(k, len(vectors))), 4),
+            "p50_ms": _percentile_ms(times, 50),
+            "p95_ms": _percentile_ms(times, 95),
+        })
+    return report
+
+def _ann_settings(cfg) -> Tuple[bool, str]:
+    """(use_ann, model) for SnippetEmbeddings from the AI config"""
+    return (bool(getattr(cfg.ai, 'use_ann_index', False)),
+            getattr(cfg.ai, 'embedding_model', None) or DEFAULT_EMBEDDING_MODEL)
+
+def get_snippet_embeddings(snippets) -> SnippetEmbeddings:
+    """
+    The shared embedding matrix, rebuilt only when `snippets` or the ANN settings
+    differ from what it was built with
+    """
+    global _snippet_embeddings
+    settings = _ann_settings(get_config())
+    if (_snippet_embeddings is None or _snippet_embeddings.settings != settings
+            or not _snippet_embeddings.matches(snippets)):
+        _snippet_embeddings = SnippetEmbeddings(snippets, *settings)
+    return _snippet_embeddings
+
+# Rank offset in reciprocal rank fusion; 60 is the value from the original RRF paper
+RRF_K = 60
+
+def hybrid_top(user_query: str, query_embedding: List[float], snippets, k: int = 3,
+               fusion: str = "rrf", embedding_weight: float = 0.5) -> List[Tuple[int, float, Dict[str, float]]]:
+    """
+    Fuse BM25 and embedding rankings in one pass over the two prebuilt indexes.
+    Each signal contributes its best max(10*k, 50) snippets as candidates, combined
+    either by reciprocal rank fusion or by a weighted sum of cosine and max-normalized
+    BM25. Returns the best k as (doc_id, fused_score, {"bm25": ..., "embedding": ...}).
+    """
+    index = get_snippet_index(snippets)
+    matrix = get_snippet_embeddings(snippets)
+    pool = max(10 * k, 50)
+
+    w_name, w_sql = SnippetIndex.FIELD_WEIGHTS
+    bm25 = {d: w_name * name + w_sql * sql for d, (name, sql) in index.field_scores(user_query).items()}
+    bm25_ranked = heapq.nsmallest(pool, bm25.items(), key=lambda x: (-x[1], x[0]))
+    embedding_ranked = matrix.top(query_embedding, k=pool)
+    embedding = dict(embedding_ranked)
+    # Snippets in only one pool still get both signals reported
+    embedding.update(matrix.score_docs(query_embedding, [d for d, _ in bm25_ranked if d not in embedding]))
+
+    candidates = {d for d, _ in bm25_ranked} | embedding.keys()
+    if fusion == "weighted":
+        top_bm25 = bm25_ranked[0][1] if bm25_ranked and bm25_ranked[0][1] > 0 else 1.0
+        fused = {d: embedding_weight * embedding.get(d, 0.0) + (1 - embedding_weight) * bm25.get(d, 0.0) / top_bm25
+                 for d in candidates}
+    else:
+        fused = dict.fromkeys(candidates, 0.0)
+        for ranked in (bm25_ranked, embedding_ranked):
+            for rank, (d, _) in enumerate(ranked, start=1):
+                fused[d] += 1.0 / (RRF_K + rank)
+
+    best = sorted(fused.items(), key=lambda x: (-x[1], x[0]))[:k]
+    return [(d, score, {"bm25": bm25.get(d, 0.0), "embedding": embedding.get(d, 0.0)}) for d, score in best]
+
 def pick_most_related(user_query: str, snippets: List[Dict[str, str]], use_bm25: bool = True) -> List[Dict[str, str]]:
     """
     Picks the top 3 most related SQL snippets based on similarity.
-    Supports BM25, Jaccard, or Embedding similarity based on config.
-    Returns list of top snippets with their scores.
+    Supports BM25, Jaccard, Embedding or hybrid BM25+Embedding similarity based on config.
+    Returns list of top snippets with their scores; hybrid results also carry the
+    per-signal scores under "scores".
     """
     if not snippets:
         return ""
@@ -196,41 +804,44 @@ def pick_most_related(user_query: str, snippets: List[Dict[str, str]], use_bm25:
     # Check both possible config fields for backward compatibility
     use_embedding_retrieval = (getattr(cfg.ai, 'use_embedding_similarity', False) or 
                                getattr(cfg.ai, 'use_embedding', False)) and embedding_model
+    use_hybrid = getattr(cfg.ai, 'use_hybrid_similarity', False) and embedding_model
 
-    if use_embedding_retrieval:
+    if use_embedding_retrieval or use_hybrid:
         # Calculate embedding for the user query
         query_embedding = calculate_embedding(user_query, embedding_model)
         if not query_embedding:
             print("❌ Warning: Failed to get query embedding. Falling back to BM25/Jaccard.")
-            use_embedding_retrieval = False # Fallback
+            use_embedding_retrieval = use_hybrid = False # Fallback
 
     snippet_scores = []
-    if use_embedding_retrieval:
+    signal_scores = []
+    if use_hybrid:
+        fusion = getattr(cfg.ai, 'hybrid_fusion', 'rrf')
+        fused = hybrid_top(user_query, query_embedding, snippets, k=3, fusion=fusion,
+                           embedding_weight=getattr(cfg.ai, 'hybrid_embedding_weight', 0.5))
+        snippet_scores = [(snippets[doc_id], score) for doc_id, score, _ in fused]
+        signal_scores = [signals for _, _, signals in fused]
+
+        print(f"\n🔀 Hybrid BM25+embedding search ({fusion}) for: '{user_query}'")
+        for doc_id, score, signals in fused:
+            print(f"  ✅ Snippet #{doc_id+1}: '{_snippet_field(snippets[doc_id], 'name')[:40]}' - Score: {score:.4f} "
+                  f"(BM25 {signals['bm25']:.4f}, embedding {signals['embedding']:.4f})")
+        if not snippet_scores:
+            print("❌ No BM25 or embedding matches. Falling back to BM25/Jaccard.")
+
+    elif use_embedding_retrieval:
         print(f"\n🧠 Performing embedding-based search for: '{user_query}'")
         print(f"📊 Total snippets to check: {len(snippets)}")
 
-        embeddings_found = 0
-        for i, snippet in enumerate(snippets):
-            # Access embedding field properly - could be in different formats
-            snippet_embedding = None
-            if hasattr(snippet, 'embedding'):
-                snippet_embedding = snippet.embedding
-            elif isinstance(snippet, dict) and 'embedding' in snippet:
-                snippet_embedding = snippet['embedding']
-
-            if not snippet_embedding:
-                print(f"⚠️  Snippet #{i+1} '{snippet.get('name', 'Unnamed')[:30]}...' missing embedding")
-                continue
-
-            embeddings_found += 1
-            score = cosine_similarity(query_embedding, snippet_embedding)
-            snippet_scores.append((snippet, score))
-            print(f"  ✅ Snippet #{i+1}: '{snippet.get('name', 'Unnamed')[:40]}' - Score: {score:.4f}")
+        matrix = get_snippet_embeddings(snippets)
+        top = matrix.top(query_embedding, k=3)
+        snippet_scores = [(snippets[doc_id], score) for doc_id, score in top]
+        for doc_id, score in top:
+            print(f"  ✅ Snippet #{doc_id+1}: '{_snippet_field(snippets[doc_id], 'name')[:40]}' - Score: {score:.4f}")
 
-        print(f"📈 Found {embeddings_found}/{len(snippets)} snippets with embeddings")
+        print(f"📈 Found {len(matrix)}/{len(snippets)} snippets with embeddings")
 
         if snippet_scores:
-            snippet_scores.sort(key=lambda x: x[1], reverse=True)
             best = snippet_scores[0][0]
             print(f"🎯 Top embedding match: '{best.get('name', 'Unnamed')}' with score {snippet_scores[0][1]:.4f}")
         else:
@@ -239,70 +850,16 @@ def pick_most_related(user_query: str, snippets: List[Dict[str, str]], use_bm25:
             use_bm25 = True # Ensure fallback occurs
             snippet_scores = [] # Reset scores for fallback
 
-    if not use_embedding_retrieval or not snippet_scores: # Fallback or if embedding not used
+    if not snippet_scores: # Fallback or if neither embedding nor hybrid retrieval was used
         if use_bm25:
-            # Prepare corpus statistics for BM25
-            all_docs = [s.get("name", "") + " " + s.get("description", "") + " " + s.get("sql", "") for s in snippets]
-            doc_lens = [len(re.findall(r"[a-zA-Z0-9]+", doc.lower())) for doc in all_docs]
-            avg_doc_len = sum(doc_lens) / len(doc_lens) if doc_lens else 50
-
-            # Build document frequency map
-            doc_freq = {}
-            for doc in all_docs:
-                terms = set(re.findall(r"[a-zA-Z0-9]+", doc.lower()))
-                for term in terms:
-                    doc_freq[term] = doc_freq.get(term, 0) + 1
-
-            corpus_stats = {
-                'avg_doc_len': avg_doc_len,
-                'total_docs': len(snippets),
-                'doc_freq': doc_freq
-            }
-
-            # Calculate scores for all snippets
-            for snippet in snippets:
-                name = snippet.get("name", "")
-                description = snippet.get("description", "")
-                sql = snippet.get("sql", "")
-
-                # Combine name and description for better matching
-                combined_text = f"{name} {description}".strip()
-
-                name_score = bm25_similarity(user_query, combined_text, corpus_stats=corpus_stats)
-                sql_score = bm25_similarity(user_query, sql, corpus_stats=corpus_stats)
-                # Weight name/description higher since it's more likely to match user intent
-                total_score = name_score * 1.5 + sql_score
-                snippet_scores.append((snippet, total_score))
+            # Score against the prebuilt index; only postings of the query's terms are visited
+            index = get_snippet_index(snippets)
+            snippet_scores = [(snippets[doc_id], score) for doc_id, score in index.top(user_query, k=3)]
 
-            # Sort by score and get the best one
-            snippet_scores.sort(key=lambda x: x[1], reverse=True)
-            best = snippet_scores[0][0] if snippet_scores else snippets[0]
-
-            # Debug: Print detailed scores for troubleshooting
+            # Debug: Print summary for troubleshooting
             print(f"\n🔍 Fresh BM25 search for: '{user_query}'")
             print(f"📊 Total snippets: {len(snippets)}")
-            print(f"📈 Corpus stats: avg_doc_len={corpus_stats['avg_doc_len']:.1f}, total_docs={corpus_stats['total_docs']}")
-            # print(f"📝 Doc frequency sample: {dict(list(corpus_stats['doc_freq'].items())[:5])}")
-
-            for i, (snippet, score) in enumerate(snippet_scores):
-                name = snippet.get('name', 'Unnamed')
-                sql_preview = snippet.get('sql', '')[:50] + '...' if len(snippet.get('sql', '')) > 50 else snippet.get('sql', '')
-
-                # Calculate individual scores for debugging with detailed output
-                # print(f"  --- Snippet #{i+1} Analysis ---")
-                # print(f"  Name: {name[:60]}")
-                # print(f"  SQL Preview: {sql_preview}")
-
-                # Calculate individual scores for debugging with detailed output
-                # print(f"  🔤 Calculating name+description score...")
-                combined_text_score = bm25_similarity(user_query, snippet.get("name", "") + " " + snippet.get("description", ""), corpus_stats=corpus_stats)
-                # print(f"  💾 Calculating SQL score...")
-                sql_score_bm25 = bm25_similarity(user_query, snippet.get("sql", ""), corpus_stats=corpus_stats)
-
-                # print(f"  📊 Final: Total={score:.4f} | Name+Desc={combined_text_score:.4f}*1.5 | SQL={sql_score_bm25:.4f}")
-
-                if i >= 2:  # Show top 3 with full detail
-                    break
+            print(f"📈 Corpus stats: avg_doc_len={index.avg_doc_len:.1f}, total_docs={index.total_docs}")
 
         else:
             # Calculate scores for all snippets using Jaccard similarity
@@ -348,6 +905,8 @@ def pick_most_related(user_query: str, snippets: List[Dict[str, str]], use_bm25:
             "score": score,
             "rank": i + 1
         })
+        if signal_scores:
+            top_snippets[-1]["scores"] = signal_scores[i]
     
     return top_snippets
 
@@ -472,14 +1031,19 @@ def offline_sql(user_query: str, table_name: str, max_rows: int = None, candidat
         # Default fallback - always return valid SQL
         return f'SELECT * FROM "{table_name}"{limit_clause};'
 
-def answer_with_data(cfg: Dict[str, Any], user_query: str, sql: str, columns: List[str], rows: List[dict], error_message: str = None) -> str:
-    """Use LLM to craft a concise answer from rows; fallback to a textual summary."""
+def answer_with_data(cfg: Dict[str, Any], user_query: str, sql: str, columns: List[str], rows: List[dict],
+                     error_message: str = None, total_rows: Optional[int] = None) -> str:
+    """
+    Use LLM to craft a concise answer from rows; fallback to a textual summary.
+    `total_rows` is the full match count when the result cap cut `rows` short
+    (QueryResult.count() of a truncated result).
+    """
     if cfg["ai"]["offline_demo_mode"]:
-        return offline_answer(user_query, sql, columns, rows, error_message)
+        return offline_answer(user_query, sql, columns, rows, error_message, total_rows)
     agent_temp = cfg["ai"].get("agent_temperature", cfg["ai"]["temperature"])
     llm = _maybe_llm(cfg["ai"]["model"], agent_temp)
     if llm is None:
-        return offline_answer(user_query, sql, columns, rows, error_message)
+        return offline_answer(user_query, sql, columns, rows, error_message, total_rows)
 
     # Get current date and time
     current_datetime = datetime.now()
@@ -494,6 +1058,7 @@ def answer_with_data(cfg: Dict[str, Any], user_query: str, sql: str, columns: Li
          "User question: {user_query}\n\n"
          "SQL used: {sql}\n\n"
          "Columns: {columns}\n\n"
+         "{truncation_note}"
          "Rows (JSON-like):\n{rows}\n\n"
          "Answer succinctly and include a 1-line takeaway. "
          "When referring to time periods like 'this month', 'today', etc., use the current date provided above.")
@@ -508,15 +1073,21 @@ def answer_with_data(cfg: Dict[str, Any], user_query: str, sql: str, columns: Li
         "sql": sql,
         "columns": columns,
         "rows": head,
+        "truncation_note": (f"Note: the query matched {total_rows} rows but the result was cut off "
+                            f"at {len(rows)}; do not treat it as complete.\n\n"
+                            if total_rows is not None and total_rows > len(rows) else ""),
         "current_date": current_date_str,
         "current_month_year": current_month_year,
     })
 
-def offline_answer(user_query: str, sql: str, columns: List[str], rows: List[dict], error_message: str = None) -> str:
+def offline_answer(user_query: str, sql: str, columns: List[str], rows: List[dict], error_message: str = None,
+                   total_rows: Optional[int] = None) -> str:
     if error_message:
         # Handle SQL error case
         if "Only SELECT/WITH" in error_message or "read-only queries are allowed" in error_message:
             return "❌ **Error**: Only SELECT, WITH, and other read-only queries are allowed in demo mode. Please ask questions that retrieve or analyze data rather than modify it."
+        elif "Query too expensive" in error_message:
+            return f"⏱️ **Query Too Expensive**: {error_message} Try narrowing your question, e.g. to a specific period, promotion or category."
         elif "no such column" in error_message.lower():
             return f"❌ **Column Error**: {error_message}. Please check the available columns in the schema above or try using different column names."
         elif "syntax error" in error_message.lower():
@@ -548,10 +1119,19 @@ def offline_answer(user_query: str, sql: str, columns: List[str], rows: List[dic
     if "count" in sql.lower() and len(columns) == 1:
         return f"**Count result:** {rows[0][columns[0]]} items found."
 
+    truncated = total_rows is not None and total_rows > n
     if "distinct" in sql.lower():
+        if truncated:
+            return f"Found {total_rows} unique values; the result was cut off at {n}. Preview shown above."
         return f"Found {n} unique values. Preview shown above."
 
+    if truncated:
+        return (f"**Query successful:** Matched {total_rows} rows; the result was cut off at {n}. "
+                f"Showing first {min(5,n)} above.")
     return f"**Query successful:** Returned {n} rows. Showing first {min(5,n)} above."
 
 # Initialize configuration
-load_config()
\ No newline at end of file
+load_config()
+if __name__ == "__main__":
+    # python -m modules.ai_agent: ANN recall/latency against exact search on synthetic embeddings
+    print(json.dumps(benchmark_ann(), indent=2))
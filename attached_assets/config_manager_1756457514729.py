@@ -6,7 +6,12 @@ import json
 import datetime
 
 CONFIG_PATH = os.path.join("config", "config.yaml")
+DEFAULT_EMBEDDING_MODEL = "text-embedding-3-small"
 EMBEDDING_CACHE_PATH = os.path.join("cache", "embedding_cache.json")
+# IVF centroids/list assignments for large snippet libraries (see ai_agent.IVFIndex)
+ANN_INDEX_PATH = os.path.join("cache", "embedding_ann.npz")
+# Embeddings of user questions, appended one JSON line per new question (see ai_agent.QueryEmbeddingCache)
+QUERY_EMBEDDING_CACHE_PATH = os.path.join("cache", "query_embedding_cache.jsonl")
 
 @dataclass
 class Snippet:
@@ -14,10 +19,13 @@ class Snippet:
     sql: str
     description: str = ""  # Added description field
     embedding: Optional[List[float]] = field(default=None, repr=False)
+    embedding_model: Optional[str] = field(default=None, repr=False)  # Model that produced `embedding`
 
-    def get_embedding_key(self) -> str:
-        """Generate a unique key for the embedding cache based on snippet name, SQL content, and description."""
-        return f"{self.name}::{self.sql}::{self.description}"
+    def get_embedding_key(self, model: str = DEFAULT_EMBEDDING_MODEL) -> str:
+        """Generate a unique key for the embedding cache based on model, snippet name, SQL content, and description."""
+        key = f"{self.name}::{self.sql}::{self.description}"
+        # Keys for the default model keep the original format so existing caches stay valid
+        return key if model == DEFAULT_EMBEDDING_MODEL else f"{model}::{key}"
 
 @dataclass
 class AIConfig:
@@ -29,7 +37,11 @@ class AIConfig:
     use_bm25_similarity: bool = True
     use_embedding_similarity: bool = False  # New field
     use_embedding: bool = False  # Core embedding flag
-    embedding_model: str = "text-embedding-3-small"
+    embedding_model: str = DEFAULT_EMBEDDING_MODEL  # Used for both snippet and query embeddings
+    use_hybrid_similarity: bool = False  # Fuse BM25 and embedding rankings
+    hybrid_fusion: str = "rrf"  # "rrf" (reciprocal rank fusion) or "weighted"
+    hybrid_embedding_weight: float = 0.5  # Embedding share of the score when hybrid_fusion is "weighted"
+    use_ann_index: bool = False  # Approximate (IVF) embedding search for large snippet libraries
     max_rows_for_ai: int = 50  # Maximum rows to send to AI for processing
     system_prompt: str = "You are a precise data assistant."
     sql_synth_prompt: str = "You are an expert SQL generator."
@@ -39,6 +51,12 @@ class DataConfig:
     file_path: str = "data/sample_sales.csv"
     table_name: str = "sales"
     additional_details: str = ""
+    # Extra tables for a multi-table catalog: [{"file_path": ..., "table_name": ..., "sheet": ...}]
+    tables: List[Dict[str, str]] = field(default_factory=list)
+
+    def sources(self) -> List[Dict[str, str]]:
+        """The primary file followed by any extra tables, as sql_engine.SQLCatalog.from_sources expects"""
+        return [{"file_path": self.file_path, "table_name": self.table_name}] + list(self.tables)
 
 @dataclass
 class AppConfig:
@@ -63,7 +81,7 @@ def save_embedding_cache(cache: Dict[str, Any]):
     with open(EMBEDDING_CACHE_PATH, 'w', encoding='utf-8') as f:
         json.dump(cache, f, ensure_ascii=False, indent=2)
 
-def generate_snippet_embedding(snippet: Snippet) -> Optional[List[float]]:
+def generate_snippet_embedding(snippet: Snippet, model: str = DEFAULT_EMBEDDING_MODEL) -> Optional[List[float]]:
     """Generate OpenAI embedding for a snippet"""
     try:
         from openai import OpenAI
@@ -82,7 +100,7 @@ def generate_snippet_embedding(snippet: Snippet) -> Optional[List[float]]:
             text += f"\n{snippet.description}"
 
         response = client.embeddings.create(
-            model="text-embedding-3-small",
+            model=model,
             input=text,
             encoding_format="float"
         )
@@ -93,26 +111,32 @@ def generate_snippet_embedding(snippet: Snippet) -> Optional[List[float]]:
         print(f"Error generating embedding for snippet '{snippet.name}': {e}")
         return None
 
-def ensure_snippets_have_embeddings(snippets: List[Snippet]) -> List[Snippet]:
-    """Ensure all snippets have embeddings, generating them if needed"""
+def ensure_snippets_have_embeddings(snippets: List[Snippet], model: str = DEFAULT_EMBEDDING_MODEL) -> List[Snippet]:
+    """Ensure all snippets have embeddings from `model`, generating them if needed"""
     cache = load_embedding_cache()
     cache_updated = False
 
     for snippet in snippets:
+        if snippet.embedding is not None and snippet.embedding_model != model:
+            # Embedded with another model; its vectors are not comparable with `model` queries
+            snippet.embedding = None
         if snippet.embedding is None:
-            embedding_key = snippet.get_embedding_key()
+            embedding_key = snippet.get_embedding_key(model)
 
             # Check cache first
             if embedding_key in cache:
                 snippet.embedding = cache[embedding_key].get("embedding")
+                snippet.embedding_model = model
             else:
                 # Generate new embedding
-                embedding = generate_snippet_embedding(snippet)
+                embedding = generate_snippet_embedding(snippet, model)
                 if embedding:
                     snippet.embedding = embedding
+                    snippet.embedding_model = model
                     # Cache the embedding
                     cache[embedding_key] = {
                         "name": snippet.name,
+                        "model": model,
                         "embedding": embedding,
                         "created_at": datetime.datetime.now().isoformat()
                     }
@@ -145,7 +169,11 @@ def load_config() -> AppConfig:
             use_bm25_similarity=ai_config_data.get("use_bm25_similarity", True),
             use_embedding_similarity=ai_config_data.get("use_embedding_similarity", False),
             use_embedding=ai_config_data.get("use_embedding", False),
-            embedding_model=ai_config_data.get("embedding_model", "text-embedding-3-small"),
+            embedding_model=ai_config_data.get("embedding_model", DEFAULT_EMBEDDING_MODEL),
+            use_hybrid_similarity=ai_config_data.get("use_hybrid_similarity", False),
+            hybrid_fusion=ai_config_data.get("hybrid_fusion", "rrf"),
+            hybrid_embedding_weight=ai_config_data.get("hybrid_embedding_weight", 0.5),
+            use_ann_index=ai_config_data.get("use_ann_index", False),
             max_rows_for_ai=ai_config_data.get("max_rows_for_ai", 50),  # Load max_rows_for_ai
             system_prompt=ai_config_data.get("system_prompt", "You are a precise data assistant."),
             sql_synth_prompt=ai_config_data.get("sql_synth_prompt", "You are an expert SQL generator.")
@@ -166,14 +194,15 @@ def load_config() -> AppConfig:
         cache = load_embedding_cache()
         for snippet in snippets:
             if snippet.embedding is None:
-                embedding_key = snippet.get_embedding_key()
+                embedding_key = snippet.get_embedding_key(ai_config.embedding_model)
                 if embedding_key in cache:
                     snippet.embedding = cache[embedding_key].get("embedding")
+                    snippet.embedding_model = ai_config.embedding_model
 
         config = AppConfig(ai=ai_config, data=data_config, snippets=snippets)
 
         # Ensure all snippets have embeddings (generates if not in cache)
-        config.snippets = ensure_snippets_have_embeddings(config.snippets)
+        config.snippets = ensure_snippets_have_embeddings(config.snippets, ai_config.embedding_model)
 
         return config
 
@@ -184,7 +213,7 @@ def load_config() -> AppConfig:
 def save_config(config: AppConfig):
     """Save the config to YAML file"""
     # Ensure snippets have embeddings before saving
-    config.snippets = ensure_snippets_have_embeddings(config.snippets)
+    config.snippets = ensure_snippets_have_embeddings(config.snippets, config.ai.embedding_model)
 
     data = {
         "ai": {
@@ -197,6 +226,10 @@ def save_config(config: AppConfig):
             "use_embedding_similarity": config.ai.use_embedding_similarity, # Updated field
             "use_embedding": config.ai.use_embedding,
             "embedding_model": config.ai.embedding_model,
+            "use_hybrid_similarity": config.ai.use_hybrid_similarity,
+            "hybrid_fusion": config.ai.hybrid_fusion,
+            "hybrid_embedding_weight": config.ai.hybrid_embedding_weight,
+            "use_ann_index": config.ai.use_ann_index,
             "max_rows_for_ai": config.ai.max_rows_for_ai, # Save max_rows_for_ai
             "system_prompt": config.ai.system_prompt,
             "sql_synth_prompt": config.ai.sql_synth_prompt,
@@ -208,6 +241,8 @@ def save_config(config: AppConfig):
         },
         "snippets": [{"name": s.name, "sql": s.sql, "description": s.description} for s in config.snippets]
     }
+    if config.data.tables:
+        data["data"]["tables"] = config.data.tables
 
     os.makedirs(os.path.dirname(CONFIG_PATH), exist_ok=True)
     with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
@@ -1,74 +1,765 @@
 import csv
+import glob
+import hashlib
+import json
+import logging
+import math
 import os
+import queue
 import re
 import sqlite3
+import tempfile
 import threading
-from typing import List, Dict, Any, Tuple, Optional
-from datetime import datetime
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from itertools import chain, islice
+from functools import partial
+from typing import List, Dict, Any, Tuple, Optional, Iterable, Iterator, Sequence, Callable
+from dataclasses import dataclass, asdict, field, replace
+from datetime import datetime, date
 import dateutil.parser
 
+logger = logging.getLogger(__name__)
+
+try:
+    import duckdb
+except Exception:
+    duckdb = None
+
 try:
     import openpyxl  # optional for .xlsx
 except Exception:
     openpyxl = None
 
+# Precompiled value patterns for type inference
+_INT_RE = re.compile(r"[+-]?\d+")
+_REAL_RE = re.compile(r"[+-]?(\d*\.\d+|\d+\.\d*)([eE][+-]?\d+)?")
+# Cheap shape check before any date parser runs (dateutil alone accepts far too much, e.g. "2"):
+# all-numeric dates, or dates spelling the month ("05-Jan-2024", "5 January 2024", "Jan 5, 2024")
+_MONTH_NAME = r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?"
+_DATE_LIKE_RE = re.compile(
+    r"\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}"
+    rf"|\d{{1,2}}[-/ ]{_MONTH_NAME}[-/ ]\d{{2,4}}"
+    rf"|{_MONTH_NAME} \d{{1,2}},? \d{{4}}",
+    re.IGNORECASE,
+)
+# Values naming a month in some other layout ("Friday, 5 January 2024") are confirmed by dateutil
+_MONTH_NAME_RE = re.compile(rf"\b{_MONTH_NAME}", re.IGNORECASE)
+
+# strptime formats tried in order when sniffing a column's date format.
+# Month-first comes before day-first, matching dateutil's default.
+DATE_FORMATS = [
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%d %H:%M:%S%z",
+    "%Y-%m-%d %H:%M:%S %z",
+    "%Y-%m-%d %H:%M:%S.%f %z",
+    "%Y-%m-%dT%H:%M:%S%z",
+    "%Y-%m-%dT%H:%M:%S.%f%z",
+    "%Y/%m/%d",
+    "%m/%d/%Y",
+    "%d/%m/%Y",
+    "%m-%d-%Y",
+    "%d-%m-%Y",
+    "%m/%d/%Y %H:%M",
+    "%m/%d/%Y %H:%M:%S",
+    "%d/%m/%Y %H:%M",
+    "%d/%m/%Y %H:%M:%S",
+    "%d-%b-%Y",
+    "%d-%b-%y",
+    "%d %b %Y",
+    "%d %B %Y",
+    "%b %d, %Y",
+    "%B %d, %Y",
+]
+
+# Share of non-empty sample values that must fit a type for the column to get it
+TYPE_MATCH_RATIO = 0.9
+
+# Directory for persistent table files; unset keeps tables in memory only
+CACHE_DIR = os.getenv("SQL_ENGINE_CACHE_DIR", "")
+# Bump when the load format changes so old cached table files are rebuilt
+CACHE_FORMAT_VERSION = 1
+# Bookkeeping table stored alongside the data in cached table files
+META_TABLE = "_simple_sqlite_meta"
+# "sqlite" (default) or "duckdb"; duckdb falls back to sqlite when the package is missing
+BACKEND = os.getenv("SQL_ENGINE_BACKEND", "sqlite")
+
+@dataclass
+class ColumnProfile:
+    name: str
+    type: str  # INTEGER, REAL, DATETIME or TEXT
+    date_format: Optional[str] = None  # strptime format for DATETIME columns; None means dateutil
+
+def _as_text(v: Any) -> str:
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    return str(v).strip()
+
+def _enough(matches: int, total: int) -> bool:
+    return total > 0 and matches >= total * TYPE_MATCH_RATIO
+
+def _dateutil_ok(s: str) -> bool:
+    try:
+        dateutil.parser.parse(s)
+        return True
+    except (ValueError, OverflowError):
+        return False
+
+def sniff_date_format(values: List[str]) -> Optional[str]:
+    """Return the first DATE_FORMATS entry that parses enough of `values`, or None"""
+    allowed_failures = len(values) - math.ceil(len(values) * TYPE_MATCH_RATIO)
+    for fmt in DATE_FORMATS:
+        failures = 0
+        for v in values:
+            try:
+                datetime.strptime(v, fmt)
+            except ValueError:
+                failures += 1
+                if failures > allowed_failures:
+                    break
+        else:
+            return fmt
+    return None
+
+def profile_column(name: str, values: Iterable[Any]) -> ColumnProfile:
+    """Infer a column's type (and date format) from a sample of its values"""
+    non_empty = [v for v in values if v is not None and v != ""]
+    if not non_empty:
+        return ColumnProfile(name, "TEXT")
+
+    texts = [_as_text(v) for v in non_empty]
+    total = len(texts)
+
+    ints = sum(1 for t in texts if _INT_RE.fullmatch(t))
+    if _enough(ints, total):
+        return ColumnProfile(name, "INTEGER")
+    if _enough(ints + sum(1 for t in texts if _REAL_RE.fullmatch(t)), total):
+        return ColumnProfile(name, "REAL")
+
+    if _enough(sum(1 for t in texts if _DATE_LIKE_RE.match(t)), total):
+        fmt = sniff_date_format(texts)
+        if fmt:
+            return ColumnProfile(name, "DATETIME", fmt)
+        if _enough(sum(1 for t in texts if _dateutil_ok(t)), total):
+            return ColumnProfile(name, "DATETIME")
+    elif _enough(sum(1 for t in texts if _MONTH_NAME_RE.search(t) and _dateutil_ok(t)), total):
+        return ColumnProfile(name, "DATETIME")
+
+    return ColumnProfile(name, "TEXT")
+
+def profile_columns(cols: List[str], sample: List[Sequence[Any]]) -> List[ColumnProfile]:
+    """Profile every column of a row sample, one column at a time"""
+    return [profile_column(c, (r[i] for r in sample)) for i, c in enumerate(cols)]
+
+# Clauses whose columns an index can serve
+_INDEXABLE_CLAUSES = {"WHERE", "ON", "ORDER BY", "GROUP BY", "HAVING"}
+_CLAUSE_RE = re.compile(
+    r"\b(WHERE|ON|ORDER\s+BY|GROUP\s+BY|HAVING|SELECT|FROM|JOIN|LIMIT|OFFSET|UNION|EXCEPT|INTERSECT)\b",
+    re.IGNORECASE,
+)
+_STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+_IDENT_RE = re.compile(r'"((?:[^"]|"")+)"|`([^`]+)`|\[([^\]]+)\]|([A-Za-z_][A-Za-z0-9_]*)')
+# Words of a question, table name or header. Thai vowel and tone marks are not \w, so the
+# Thai block is listed explicitly; Thai is written without spaces, so Thai terms match as substrings
+_TERM_RE = re.compile(r"(?:[^\W_]|[\u0E00-\u0E7F])+")
+_THAI_RE = re.compile(r"[\u0E00-\u0E7F]")
+
+# A comparison an index can serve has the bare column on one side: no arithmetic or
+# function call around it (`id % 7 = 0` and `lower(name) = 'x'` scan regardless)
+_COMPARISON_AFTER_RE = re.compile(r"\s*(?:==|=|<>|!=|<=|>=|<|>|(?:NOT\s+)?(?:IN|BETWEEN)\b|IS\b)", re.IGNORECASE)
+_COMPARISON_BEFORE_RE = re.compile(r"(?:==|=|<>|!=|<=|>=|<|>)\s*$")
+_OPERAND_AFTER_RE = re.compile(r"\s*[-+*/%|&(]")
+_OPERAND_BEFORE_RE = re.compile(r"[-+*/%|&]\s*$")
+_QUALIFIER_RE = re.compile(r'(?:"(?:[^"]|"")+"|`[^`]+`|\[[^\]]+\]|[A-Za-z_][A-Za-z0-9_]*)\s*\.\s*$')
+_ORDER_ITEM_RE = re.compile(r"\s*(?:ASC|DESC)?\s*(?:NULLS\s+(?:FIRST|LAST))?\s*$", re.IGNORECASE)
+
+def _split_top_level(body: str) -> List[Tuple[int, str]]:
+    """(offset, text) of the comma-separated items of `body`, ignoring commas inside parentheses"""
+    items, depth, start = [], 0, 0
+    for i, ch in enumerate(body):
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            items.append((start, body[start:i]))
+            start = i + 1
+    items.append((start, body[start:]))
+    return items
+
+def filter_columns(sql: str, columns: Iterable[str]) -> List[str]:
+    """
+    Names from `columns` that `sql` compares, joins, groups or sorts on in a form an
+    index can serve, in order of appearance: a bare (optionally qualified) column
+    compared with =, <, IN, BETWEEN, IS, ..., or a bare ORDER BY / GROUP BY key
+    """
+    by_lower = {c.lower(): c for c in columns}
+    parts = _CLAUSE_RE.split(_STRING_LITERAL_RE.sub("''", sql))
+    found: List[str] = []
+    for keyword, body in zip(parts[1::2], parts[2::2]):
+        clause = " ".join(keyword.upper().split())
+        if clause not in _INDEXABLE_CLAUSES:
+            continue
+        sort_keys = clause in ("ORDER BY", "GROUP BY")
+        items = _split_top_level(body) if sort_keys else [(0, body)]
+        for offset, item in items:
+            for m in _IDENT_RE.finditer(item):
+                name = next(g for g in m.groups() if g is not None).replace('""', '"')
+                col = by_lower.get(name.lower())
+                if not col or col in found:
+                    continue
+                before = _QUALIFIER_RE.sub("", item[:m.start()])
+                after = item[m.end():]
+                if after.lstrip().startswith("."):
+                    continue  # a table name or alias, not the column
+                if sort_keys:
+                    usable = not before.strip() and _ORDER_ITEM_RE.fullmatch(after) is not None
+                else:
+                    usable = ((_COMPARISON_AFTER_RE.match(after) and not _OPERAND_BEFORE_RE.search(before))
+                              or (_COMPARISON_BEFORE_RE.search(before) and not _OPERAND_AFTER_RE.match(after)))
+                if usable:
+                    found.append(col)
+    return found
+
+# Whitespace runs outside string literals collapse to one space when normalizing SQL
+_SQL_TOKEN_RE = re.compile(r"'(?:[^']|'')*'|\s+")
+# Queries whose results differ between runs are never served from the result cache
+_NONDETERMINISTIC_RE = re.compile(r"\brandom(blob)?\s*\(", re.IGNORECASE)
+
+def normalize_sql(sql: str) -> str:
+    """Canonical form for cache keys: collapsed whitespace, no trailing semicolons, literals untouched"""
+    collapsed = _SQL_TOKEN_RE.sub(lambda m: m.group(0) if m.group(0).startswith("'") else " ", sql)
+    return collapsed.strip().rstrip(";").strip()
+
+def _count_sql(sql: str) -> str:
+    """
+    COUNT(*) over a query as written. The query keeps its own line breaks (unlike
+    normalize_sql, which is for cache keys only), so a trailing `--` comment ends
+    at the newline instead of swallowing the closing paren.
+    """
+    return f"SELECT COUNT(*) FROM (\n{sql.strip().rstrip(';').rstrip()}\n)"
+
+def _short_repr(value: Any, limit: int = 40) -> str:
+    text = repr(value)
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+def _row_bytes(row: Sequence[Any]) -> int:
+    """Rough payload size of a result row, for the byte cap"""
+    return sum(len(v) if isinstance(v, (str, bytes)) else 8 for v in row)
+
+@dataclass
+class QueryResult:
+    """Rows of a capped query; `truncated` is set when the row or byte cap cut it short"""
+    columns: List[str]
+    rows: List[Dict[str, Any]]
+    truncated: bool = False
+    bytes: int = 0
+    _counter: Optional[Callable[[], int]] = field(default=None, repr=False, compare=False)
+    _count: Optional[int] = field(default=None, repr=False, compare=False)
+
+    def count(self) -> int:
+        """Exact row count of the full query; only truncated results run a COUNT(*), once"""
+        if not self.truncated or self._counter is None:
+            return len(self.rows)
+        if self._count is None:
+            self._count = self._counter()
+        return self._count
+
+    def __iter__(self):
+        """Unpacks as (columns, rows), the shape execute_safe_select() has always returned"""
+        return iter((self.columns, self.rows))
+
+class QueryResultCache:
+    """
+    In-process LRU of SELECT results keyed by (normalized SQL, table version).
+    Entries expire after `ttl` seconds; the cache holds at most `max_entries`
+    results and `max_rows` rows in total, evicting least recently used first.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 256, max_rows: int = 100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._entries: "OrderedDict[tuple, Tuple[float, QueryResult]]" = OrderedDict()
+        self._rows = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, key: tuple) -> Optional[QueryResult]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                self._drop(key)
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: tuple, result: QueryResult):
+        if len(result.rows) > self.max_rows:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic(), result)
+            self._rows += len(result.rows)
+            while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key: tuple):
+        _, result = self._entries.pop(key)
+        self._rows -= len(result.rows)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._rows = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "rows": self._rows,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+class QueryTooExpensive(ValueError):
+    """
+    Raised when a query's estimated cost, wall-clock time or VM-step count exceeds
+    its budget. `reason` is "cost", "timeout" or "steps"; the message ends with HINT
+    so the agent's retry prompt tells the model how to narrow the SQL.
+    """
+
+    HINT = "Add selective WHERE filters, avoid cross joins and unbounded recursive CTEs, or aggregate before joining."
+
+    def __init__(self, reason: str, limit: float, observed: float):
+        self.reason = reason
+        self.limit = limit
+        self.observed = observed
+        super().__init__(f"Query too expensive ({reason}: {observed:g} exceeds limit {limit:g}). {self.HINT}")
+
+class _ReadWriteLock:
+    """Many concurrent readers or one writer; a waiting writer blocks new readers"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            while self._writer:
+                self._cond.wait()
+            self._writer = True
+            while self._readers:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
 class SimpleSQLite:
-    def __init__(self, table_name: str):
+    # Rows handed to each executemany() call when loading
+    LOAD_BATCH_SIZE = 5000
+    # Rows examined to infer column types before streaming the rest
+    TYPE_SAMPLE_ROWS = 1000
+    # Read-only connections kept for concurrent SELECTs
+    READ_POOL_SIZE = int(os.getenv("SQL_ENGINE_READ_POOL_SIZE", "4"))
+    # Full-scan queries touching a column before the advisor indexes it
+    INDEX_HOT_THRESHOLD = int(os.getenv("SQL_ENGINE_INDEX_THRESHOLD", "3"))
+    # Most indexes the advisor keeps on one table
+    MAX_INDEXES = int(os.getenv("SQL_ENGINE_MAX_INDEXES", "8"))
+    # Tables smaller than this are cheap to scan and never get advisor or snippet indexes
+    INDEX_MIN_ROWS = int(os.getenv("SQL_ENGINE_INDEX_MIN_ROWS", "10000"))
+    # Hard caps on what one query may materialize, and rows per fetchmany() call
+    MAX_RESULT_ROWS = int(os.getenv("SQL_ENGINE_MAX_RESULT_ROWS", "10000"))
+    MAX_RESULT_BYTES = int(os.getenv("SQL_ENGINE_MAX_RESULT_BYTES", str(32 * 1024 * 1024)))
+    FETCH_BATCH_SIZE = 500
+    # Per-query budgets: wall-clock seconds, SQLite VM steps, and the EXPLAIN QUERY PLAN
+    # estimate of rows visited (0 disables each)
+    QUERY_TIMEOUT = float(os.getenv("SQL_ENGINE_QUERY_TIMEOUT", "10"))
+    QUERY_MAX_STEPS = int(os.getenv("SQL_ENGINE_QUERY_MAX_STEPS", "1000000000"))
+    QUERY_MAX_COST = float(os.getenv("SQL_ENGINE_QUERY_MAX_COST", "1e9"))
+    # VM instructions between progress handler calls
+    PROGRESS_INTERVAL = 10000
+    # Distinct values tracked per column by column_stats(); past this only min/max are kept
+    STATS_MAX_DISTINCT = 1000
+    # Whether schema_text() lists per-column stats by default
+    SCHEMA_STATS = os.getenv("SQL_ENGINE_SCHEMA_STATS", "0") == "1"
+
+    def __init__(self, table_name: str, db_path: Optional[str] = None):
         self.table_name = table_name
-        self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self.db_path = db_path
+        # A named shared-cache in-memory database lets the read pool (and other engines'
+        # ATTACH) see the writer's table
+        self._connect_target = db_path or f"file:simple_sqlite_{uuid.uuid4().hex}?mode=memory&cache=shared"
+
+        # self.conn is the writer connection, used for loads under self.lock;
+        # queries go through the read pool under rw_lock.read()
+        self.conn = self._connect()
         self.lock = threading.Lock()
-        self.conn.row_factory = sqlite3.Row
+        self.rw_lock = _ReadWriteLock()
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._reader_count = 0
+        self._stats_lock = threading.Lock()
+        self.query_stats = {"queries": 0, "wait_seconds": 0.0, "exec_seconds": 0.0, "max_wait_seconds": 0.0}
+        self.load_stats: Dict[str, Any] = {}
+        # Bumped on every reload so cached results from an older table never match
+        self.table_version = 0
+        # schema_text() output per (table_version, sample_rows, stats), and column_stats() per version
+        self._schema_cache: Dict[Tuple[int, int, bool], str] = {}
+        self._column_stats: Optional[Tuple[int, Dict[str, Dict[str, Any]]]] = None
+        self.result_cache = QueryResultCache(
+            ttl=float(os.getenv("SQL_ENGINE_RESULT_CACHE_TTL", "300")),
+            max_entries=int(os.getenv("SQL_ENGINE_RESULT_CACHE_MAX_ENTRIES", "256")),
+            max_rows=int(os.getenv("SQL_ENGINE_RESULT_CACHE_MAX_ROWS", "100000")),
+        )
+        self.column_profiles: List[ColumnProfile] = []
+        # Index advisor state: full-scan hits per column and the columns indexed so far
+        self.column_hits: Dict[str, int] = {}
+        self.indexed_columns: List[str] = []
+        # Other engines ATTACHed to this one's read connections, by table name
+        self.attached: Dict[str, "SimpleSQLite"] = {}
+        # (path, fingerprint) of the file this table was built from, if any
+        self.source: Optional[Tuple[str, str]] = None
+        # Whether the file is in WAL mode, where readers never wait on the writer connection
+        self.wal = False
+
+    @classmethod
+    def open_file(cls, db_path: str, table_name: str) -> "SimpleSQLite":
+        """Open a table file written by save_meta(), restoring its column profile"""
+        engine = cls(table_name, db_path=db_path)
+        # WAL lets the read pool run alongside the writer connection
+        engine.conn.execute("PRAGMA journal_mode = WAL")
+        engine.wal = True
+        meta = {row[0]: json.loads(row[1]) for row in engine.conn.execute(f'SELECT key, value FROM "{META_TABLE}"')}
+        engine.column_profiles = [ColumnProfile(**p) for p in meta["column_profiles"]]
+        engine.load_stats = meta.get("load_stats", {})
+        if meta.get("source"):
+            engine.source = tuple(meta["source"])
+        engine.indexed_columns = engine._existing_indexes()
+        # Schema text and stats were built against this same table, so they stay valid
+        engine._schema_cache = {(engine.table_version, n, bool(st)): text for n, st, text in meta.get("schema_text", [])}
+        if meta.get("column_stats") is not None:
+            engine._column_stats = (engine.table_version, meta["column_stats"])
+        return engine
+
+    def save_meta(self):
+        """Persist the column profile and load details next to the table"""
+        meta = {
+            "column_profiles": [asdict(p) for p in self.column_profiles],
+            "load_stats": self.load_stats,
+            "source": list(self.source) if self.source else None,
+            "schema_text": [[n, st, text] for (version, n, st), text in self._schema_cache.items()
+                            if version == self.table_version],
+            "column_stats": self._column_stats[1] if self._column_stats and self._column_stats[0] == self.table_version else None,
+        }
+        with self._writer():
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{META_TABLE}" (key TEXT PRIMARY KEY, value TEXT)')
+            self.conn.executemany(
+                f'INSERT OR REPLACE INTO "{META_TABLE}" (key, value) VALUES (?, ?)',
+                [(k, json.dumps(v, default=str)) for k, v in meta.items()]
+            )
+            self.conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        # uri=True so in-memory targets can be ATTACHed; plain paths are still read as filenames
+        conn = sqlite3.connect(self._connect_target, uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def _writer(self):
+        """Exclusive access for reloads: waits for in-flight reads and holds new ones back"""
+        with self.rw_lock.write(), self.lock:
+            # Idle readers would keep the file open and block journal mode changes
+            self._close_readers()
+            yield self.conn
+
+    def _close_readers(self):
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        self._reader_count = 0
+
+    @contextmanager
+    def _reader(self):
+        """Borrow a read-only pooled connection, recording queue wait vs execution time"""
+        requested = time.perf_counter()
+        with self.rw_lock.read():
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                with self._stats_lock:
+                    can_open = self._reader_count < self.READ_POOL_SIZE
+                    if can_open:
+                        self._reader_count += 1
+                if can_open:
+                    conn = self._connect()
+                    for name, other in self.attached.items():
+                        alias = re.sub(r"[^A-Za-z0-9_]+", "_", f"src_{name}")
+                        conn.execute(f'ATTACH DATABASE ? AS "{alias}"', (other._connect_target,))
+                    conn.execute("PRAGMA query_only = ON")
+                else:
+                    conn = self._readers.get()
+            acquired = time.perf_counter()
+            try:
+                yield conn
+            finally:
+                self._readers.put(conn)
+                self._record_query(acquired - requested, time.perf_counter() - acquired)
+
+    def _record_query(self, wait: float, execution: float):
+        with self._stats_lock:
+            stats = self.query_stats
+            stats["queries"] += 1
+            stats["wait_seconds"] += wait
+            stats["exec_seconds"] += execution
+            stats["max_wait_seconds"] = max(stats["max_wait_seconds"], wait)
+
+    def _index_sql(self, column: str) -> str:
+        digest = hashlib.sha1(column.encode("utf-8")).hexdigest()[:8]
+        name = re.sub(r"[^A-Za-z0-9_]+", "_", f"ix_{self.table_name}_{column}")[:48] + f"_{digest}"
+        return f'CREATE INDEX IF NOT EXISTS "{name}" ON "{self.table_name}" ("{column}")'
+
+    def _existing_indexes(self) -> List[str]:
+        """Leading columns of advisor indexes already present in the database"""
+        names = self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND name LIKE 'ix!_%' ESCAPE '!'",
+            (self.table_name,)
+        ).fetchall()
+        columns = []
+        for (name,) in names:
+            info = self.conn.execute(f'PRAGMA index_info("{name}")').fetchall()
+            if info and info[0][2] not in columns:
+                columns.append(info[0][2])
+        return columns
+
+    def _query_plan(self, conn: sqlite3.Connection, sql: str) -> List[Tuple[int, int, str]]:
+        """(id, parent, detail) rows of EXPLAIN QUERY PLAN, or [] if the statement cannot be planned"""
+        try:
+            return [(row[0], row[1], row[3].upper()) for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+        except sqlite3.Error:
+            return []
+
+    @staticmethod
+    def _is_full_scan(plan: List[Tuple[int, int, str]]) -> bool:
+        """True when the plan has a table scan that uses no index"""
+        return any(
+            detail.startswith("SCAN") and "INDEX" not in detail and "SUBQUERY" not in detail
+            and "CONSTANT" not in detail
+            for _, _, detail in plan
+        )
+
+    def estimate_cost(self, plan: List[Tuple[int, int, str]]) -> float:
+        """
+        Rough rows-visited estimate from a query plan. Loops under the same parent are
+        nested, so their factors multiply (a full SCAN costs the table's row count, an
+        index SEARCH about log2 of it). Subqueries and compound parts add to their
+        parent's cost, except CORRELATED subqueries, which rerun once per row of the
+        parent's loops and so multiply.
+        """
+        n = max([self.load_stats.get("rows") or 0] + [o.load_stats.get("rows") or 0 for o in self.attached.values()] + [1])
+        loops: Dict[int, float] = {}
+        children: Dict[int, List[Tuple[int, str]]] = {}
+        for node, parent, detail in plan:
+            children.setdefault(parent, []).append((node, detail))
+            if detail.startswith("SCAN") and "CONSTANT" not in detail:
+                factor = float(n)
+            elif detail.startswith("SEARCH"):
+                factor = max(math.log2(n), 1.0)
+            else:
+                continue
+            loops[parent] = loops.get(parent, 1.0) * factor
+
+        def cost(parent: int) -> float:
+            total = loops.get(parent, 0.0)
+            for node, detail in children.get(parent, []):
+                runs = max(loops.get(parent, 1.0), 1.0) if detail.startswith("CORRELATED") else 1.0
+                total += runs * cost(node)
+            return total
+
+        return cost(0)
+
+    def _note_filter_columns(self, sql: str, plan: List[Tuple[int, int, str]]) -> List[str]:
+        """Count the filter/join/sort columns of a full-scan query; returns columns now hot enough to index"""
+        if len(self.indexed_columns) >= self.MAX_INDEXES or not self._worth_indexing():
+            return []
+        columns = [c for c in filter_columns(sql, [p.name for p in self.column_profiles])
+                   if c not in self.indexed_columns]
+        if not columns or not self._is_full_scan(plan):
+            return []
+        with self._stats_lock:
+            for c in columns:
+                self.column_hits[c] = self.column_hits.get(c, 0) + 1
+            return [c for c in columns if self.column_hits[c] >= self.INDEX_HOT_THRESHOLD]
+
+    def _worth_indexing(self) -> bool:
+        return (self.load_stats.get("rows") or 0) >= self.INDEX_MIN_ROWS
+
+    @contextmanager
+    def _index_writer(self):
+        """
+        The writer connection for CREATE INDEX. In WAL mode readers keep reading the last
+        commit while it runs, so only other writers wait; a shared-cache in-memory table
+        locks them out instead, so that still takes the full _writer()
+        """
+        if self.wal:
+            with self.lock:
+                yield self.conn
+        else:
+            with self._writer() as conn:
+                yield conn
+
+    def create_indexes(self, columns: Iterable[str]) -> List[str]:
+        """Index each column, up to MAX_INDEXES per table; returns the columns newly indexed"""
+        created = []
+        with self._index_writer():
+            for column in columns:
+                if column in self.indexed_columns or len(self.indexed_columns) >= self.MAX_INDEXES:
+                    continue
+                self.conn.execute(self._index_sql(column))
+                self.indexed_columns.append(column)
+                created.append(column)
+            self.conn.commit()
+        if created:
+            logger.info('Created indexes on "%s": %s', self.table_name, ", ".join(created))
+        return created
+
+    def index_snippet_columns(self, sqls: Iterable[str], limit: Optional[int] = None) -> List[str]:
+        """
+        Pre-create indexes for the columns configured snippet queries filter, join or sort on,
+        most referenced first. At most `limit` (default half of MAX_INDEXES) are created so
+        the advisor keeps room for columns that turn out hot at query time. Tables below
+        INDEX_MIN_ROWS are left alone.
+        """
+        if not self._worth_indexing():
+            return []
+        names = [p.name for p in self.column_profiles]
+        counts: Dict[str, int] = {}
+        for sql in sqls:
+            for c in filter_columns(sql or "", names):
+                counts[c] = counts.get(c, 0) + 1
+        limit = self.MAX_INDEXES // 2 if limit is None else limit
+        ranked = [c for c in sorted(counts, key=counts.get, reverse=True) if c not in self.indexed_columns]
+        return self.create_indexes(ranked[:max(0, limit - len(self.indexed_columns))])
+
+    @contextmanager
+    def _budget(self, conn: sqlite3.Connection, timeout: float = 0, max_steps: int = 0):
+        """Abort the statement running on `conn` once it passes its wall-clock or VM-step budget"""
+        start = time.monotonic()
+        state = {"steps": 0, "reason": None}
+
+        def progress():
+            state["steps"] += self.PROGRESS_INTERVAL
+            if max_steps and state["steps"] > max_steps:
+                state["reason"] = "steps"
+                return 1
+            if timeout and time.monotonic() - start > timeout:
+                state["reason"] = "timeout"
+                return 1
+            return 0
+
+        conn.set_progress_handler(progress, self.PROGRESS_INTERVAL)
+        # interrupt() backstops long stretches inside SQLite between progress callbacks
+        timer = threading.Timer(timeout, conn.interrupt) if timeout else None
+        if timer:
+            timer.daemon = True
+            timer.start()
+        try:
+            yield
+        except sqlite3.OperationalError as e:
+            if "interrupted" not in str(e):
+                raise
+            if state["reason"] == "steps":
+                raise QueryTooExpensive("steps", max_steps, state["steps"]) from e
+            raise QueryTooExpensive("timeout", timeout, round(time.monotonic() - start, 3)) from e
+        finally:
+            if timer:
+                timer.cancel()
+            conn.set_progress_handler(None, 0)
+
+    def attach(self, other: "SimpleSQLite"):
+        """Make `other`'s table visible to this engine's queries, for cross-table joins"""
+        if other is self or self.attached.get(other.table_name) is other:
+            return
+        # Taking the writer drops pooled readers, so new ones open with the attachment
+        with self._writer():
+            self.attached[other.table_name] = other
+
+    def query_metrics(self) -> Dict[str, Any]:
+        """Query counts with average time spent waiting for a connection vs executing"""
+        with self._stats_lock:
+            stats = dict(self.query_stats)
+        n = stats["queries"] or 1
+        stats["avg_wait_ms"] = round(stats["wait_seconds"] / n * 1000, 3)
+        stats["avg_exec_ms"] = round(stats["exec_seconds"] / n * 1000, 3)
+        stats["read_connections"] = self._reader_count
+        stats["result_cache"] = self.result_cache.stats()
+        return stats
+
+    def close(self):
+        with self._writer():
+            self.conn.close()
+
+    def source_changed(self) -> bool:
+        """Cheap stat-based check whether the source file moved on since this table was built"""
+        if not self.source:
+            return False
+        path, fingerprint = self.source
+        try:
+            return _stat_key(path) != fingerprint.split(":", 1)[0]
+        except OSError:
+            return True
 
     def _infer_type(self, s: str) -> str:
-        if s is None:
-            return "TEXT"
-        s = str(s).strip()
-        if not s:
-            return "TEXT"
-            
-        # int?
-        if re.fullmatch(r"[+-]?\d+", s):
-            return "INTEGER"
-        # float?
-        if re.fullmatch(r"[+-]?(\d*\.\d+|\d+\.\d*)([eE][+-]?\d+)?", s):
-            return "REAL"
-        # datetime detection - check various formats
-        if self._is_datetime(s):
-            return "DATETIME"
-        return "TEXT"
-    
+        return profile_column("", [s]).type
+
     def _is_datetime(self, s: str) -> bool:
         """Check if string represents a datetime value"""
-        try:
-            # Common datetime patterns
-            datetime_patterns = [
-                r"\d{4}-\d{2}-\d{2}",  # YYYY-MM-DD
-                r"\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2}",  # YYYY-MM-DD HH:MM:SS
-                r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}",  # ISO format
-                r"\d{2}/\d{2}/\d{4}",  # MM/DD/YYYY
-                r"\d{2}-\d{2}-\d{4}",  # MM-DD-YYYY
-                r"\d{1,2}/\d{1,2}/\d{4}",  # M/D/YYYY
-            ]
-            
-            # Check patterns first for performance
-            for pattern in datetime_patterns:
-                if re.fullmatch(pattern, s):
-                    # Try to actually parse it to confirm
-                    try:
-                        dateutil.parser.parse(s)
-                        return True
-                    except:
-                        continue
-            
-            # Try parsing with dateutil for other formats
-            try:
-                dateutil.parser.parse(s)
-                return True
-            except:
-                return False
-        except:
-            return False
-    
+        return s is not None and self._infer_type(s) == "DATETIME"
+
     def _parse_datetime(self, s: str) -> str:
         """Parse datetime string to ISO format for SQLite"""
         if s is None or str(s).strip() == "":
@@ -79,43 +770,129 @@ class SimpleSQLite:
         except:
             return str(s)  # Return original if parsing fails
 
-    def load_rows(self, rows: List[Dict[str, Any]]):
-        if not rows:
+    def _make_converter(self, profile: ColumnProfile):
+        """
+        Build the converter for a column once, instead of branching per cell.
+        Returns None for columns whose values are stored as-is.
+        """
+        if profile.type in ("INTEGER", "REAL"):
+            # Convert empty strings to None for numeric columns
+            return lambda val: None if val == "" else val
+        if profile.type == "DATETIME":
+            # Parse datetime values to ISO format, with the sniffed format when there is one
+            fallback = self._parse_datetime
+            fmt = profile.date_format
+            strptime = datetime.strptime
+
+            def convert(val):
+                if val is None or val == "":
+                    return None
+                if isinstance(val, (datetime, date)):
+                    return val.isoformat()
+                if fmt:
+                    try:
+                        return strptime(val.strip(), fmt).isoformat()
+                    except (ValueError, AttributeError):
+                        pass
+                return fallback(val)
+            return convert
+        return None
+
+    def _iter_batches(self, rows: Iterable[Sequence[Any]], converters, batch_size: int):
+        """Yield lists of converted value tuples, batch_size rows at a time, converting column-wise"""
+        def convert(batch):
+            if all(conv is None for conv in converters):
+                return batch
+            columns = [col if conv is None else list(map(conv, col))
+                       for conv, col in zip(converters, zip(*batch))]
+            return list(zip(*columns))
+
+        batch = []
+        for r in rows:
+            batch.append(r)
+            if len(batch) >= batch_size:
+                yield convert(batch)
+                batch = []
+        if batch:
+            yield convert(batch)
+
+    def load_rows(self, rows: Iterable[Dict[str, Any]], batch_size: Optional[int] = None):
+        """Load dict rows (list or any iterable); column names come from the first row"""
+        rows = iter(rows)
+        first = next(rows, None)
+        if not first:
             raise ValueError("No rows to load")
-        # infer types from first non-empty row
-        cols = list(rows[0].keys())
-        types = []
-        for c in cols:
-            v = next((r.get(c) for r in rows if r.get(c) not in (None, "")), None)
-            types.append(self._infer_type(v) if v is not None else "TEXT")
+        cols = list(first.keys())
+        tuples = (tuple(r.get(c) for c in cols) for r in chain([first], rows))
+        self.load_tuples(cols, tuples, batch_size=batch_size)
+
+    def load_tuples(self, cols: List[str], rows: Iterable[Sequence[Any]], batch_size: Optional[int] = None,
+                    sample_rows: Optional[int] = None):
+        """
+        Stream value tuples (in `cols` order) into the table. Column types are profiled
+        from the first `sample_rows` (default TYPE_SAMPLE_ROWS) rows, then every row goes
+        straight to SQLite in batches, so peak memory follows the batch size rather
+        than the row count.
+        """
+        rows = iter(rows)
+        sample = list(islice(rows, sample_rows or self.TYPE_SAMPLE_ROWS))
+        if not sample:
+            raise ValueError("No rows to load")
+
+        self.column_profiles = profile_columns(cols, sample)
+        types = [p.type for p in self.column_profiles]
 
         # Map DATETIME to TEXT for SQLite storage but track datetime columns
-        datetime_cols = {c for c, t in zip(cols, types) if t == "DATETIME"}
-        numeric_cols = {c for c, t in zip(cols, types) if t in ("INTEGER", "REAL")}
         sql_types = ["TEXT" if t == "DATETIME" else t for t in types]
-        
+        converters = [self._make_converter(p) for p in self.column_profiles]
+
         col_defs = ", ".join(f'"{c}" {t}' for c, t in zip(cols, sql_types))
-        with self.lock:
+        col_list = ", ".join(f'"{c}"' for c in cols)
+        placeholders = ", ".join("?" for _ in cols)
+        insert_sql = f'INSERT INTO "{self.table_name}" ({col_list}) VALUES ({placeholders})'
+
+        start = time.perf_counter()
+        loaded = 0
+        with self._writer():
+            # The table is rebuilt from the source file on failure, so skip journaling and syncs
+            self.conn.execute("PRAGMA journal_mode = OFF")
+            self.wal = False
+            self.conn.execute("PRAGMA synchronous = OFF")
             self.conn.execute(f'DROP TABLE IF EXISTS "{self.table_name}"')
             self.conn.execute(f'CREATE TABLE "{self.table_name}" ({col_defs})')
 
-            placeholders = ", ".join("?" for _ in cols)
-            insert_sql = f'INSERT INTO "{self.table_name}" ({", ".join([f'"{c}"' for c in cols])}) VALUES ({placeholders})'
-            for r in rows:
-                values = []
-                for c in cols:
-                    val = r.get(c, None)
-                    # Convert empty strings to None for numeric columns
-                    if c in numeric_cols and val == "":
-                        val = None
-                    # Parse datetime values to ISO format
-                    elif c in datetime_cols and val is not None and val != "":
-                        val = self._parse_datetime(val)
-                    values.append(val)
-                self.conn.execute(insert_sql, values)
+            for batch in self._iter_batches(chain(sample, rows), converters, batch_size or self.LOAD_BATCH_SIZE):
+                self.conn.executemany(insert_sql, batch)
+                loaded += len(batch)
+
+            # Rebuild advisor indexes once the rows are in, rather than maintaining them per insert
+            self.indexed_columns = [c for c in self.indexed_columns if c in cols]
+            for column in self.indexed_columns:
+                self.conn.execute(self._index_sql(column))
             self.conn.commit()
+            self.table_version += 1
+            self.result_cache.clear()
+
+        elapsed = time.perf_counter() - start
+        self.load_stats = {
+            "rows": loaded,
+            "seconds": round(elapsed, 3),
+            "rows_per_sec": round(loaded / elapsed, 1) if elapsed > 0 else None,
+        }
+        logger.info('Loaded %d rows into "%s" in %.2fs (%s rows/sec)',
+                    loaded, self.table_name, elapsed, self.load_stats["rows_per_sec"])
 
-    def execute_safe_select(self, sql: str) -> Tuple[List[str], List[Dict[str, Any]]]:
+    def execute_safe_select(self, sql: str) -> QueryResult:
+        """
+        Run a read-only query; rows are capped at MAX_RESULT_ROWS / MAX_RESULT_BYTES.
+        The result still unpacks as (columns, rows); check `truncated` (and count())
+        before reporting how many rows matched
+        """
+        return self.select(sql)
+
+    @staticmethod
+    def _check_read_only(sql: str) -> Tuple[str, str, str]:
+        """Validate a query; returns (sql to execute, sql without code fences, first keyword)"""
         # Clean and normalize the SQL
         original_sql = sql.strip()
         s = original_sql
@@ -162,29 +939,165 @@ class SimpleSQLite:
         if first_word not in allowed_first_words:
             raise ValueError(f"Only SELECT/WITH and other read-only queries are allowed in demo mode. Got: {first_word} (from: {first_meaningful_line[:50]}...)")
         
-        # Execute the original SQL (not the processed version)
-        with self.lock:
-            cur = self.conn.execute(original_sql)
+        return original_sql, s, first_word
+
+    def select(self, sql: str, max_rows: Optional[int] = None, max_bytes: Optional[int] = None) -> QueryResult:
+        """
+        Run a read-only query, fetching in FETCH_BATCH_SIZE batches and stopping once
+        `max_rows` rows or `max_bytes` of values (defaults MAX_RESULT_ROWS / MAX_RESULT_BYTES)
+        have been read, so memory per query stays bounded. result.count() gives the exact
+        total, running a COUNT(*) only if the result was truncated.
+        """
+        original_sql, s, first_word = self._check_read_only(sql)
+        max_rows = self.MAX_RESULT_ROWS if max_rows is None else max_rows
+        max_bytes = self.MAX_RESULT_BYTES if max_bytes is None else max_bytes
+
+        # Identical questions usually yield identical SQL; serve those from the result cache.
+        # Cached rows are shared between callers, so treat returned dicts as read-only.
+        cache_key = None
+        if self.result_cache.enabled and first_word in ("SELECT", "WITH") and not _NONDETERMINISTIC_RE.search(s):
+            versions = (self.table_version,) + tuple(o.table_version for o in self.attached.values())
+            cache_key = (normalize_sql(s), versions, max_rows, max_bytes)
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                return replace(cached, columns=list(cached.columns), rows=list(cached.rows))
+
+        rows: List[Dict[str, Any]] = []
+        size = 0
+        truncated = False
+        # Execute the original SQL (not the processed version) on a pooled read connection,
+        # refusing plans that look too costly and stopping any that overrun their budget
+        is_select = first_word in ("SELECT", "WITH")
+        with self._reader() as conn, self._budget(conn, self.QUERY_TIMEOUT, self.QUERY_MAX_STEPS):
+            plan = self._query_plan(conn, original_sql) if is_select else []
+            cost = self.estimate_cost(plan)
+            if self.QUERY_MAX_COST and cost > self.QUERY_MAX_COST:
+                raise QueryTooExpensive("cost", self.QUERY_MAX_COST, cost)
+
+            cur = conn.execute(original_sql)
             col_names = [d[0] for d in cur.description]
-            data = [dict(row) for row in cur.fetchall()]
-        return col_names, data
+            while not truncated:
+                batch = cur.fetchmany(self.FETCH_BATCH_SIZE)
+                if not batch:
+                    break
+                for row in batch:
+                    row_size = _row_bytes(row)
+                    if len(rows) >= max_rows or size + row_size > max_bytes:
+                        truncated = True
+                        break
+                    rows.append(dict(row))
+                    size += row_size
+            cur.close()
+            hot = self._note_filter_columns(original_sql, plan) if is_select else []
+        if hot:
+            self.create_indexes(hot)
 
-    def schema_text(self, sample_rows: int = 3) -> str:
-        # build CREATE TABLE-ish schema description
-        with self.lock:
-            info = self.conn.execute(f'PRAGMA table_info("{self.table_name}")').fetchall()
+        counter = partial(self._count_rows, s) if truncated else None
+        result = QueryResult(col_names, rows, truncated=truncated, bytes=size, _counter=counter)
+        if cache_key is not None:
+            self.result_cache.put(cache_key, result)
+        return replace(result, rows=list(rows))
+
+    def _count_rows(self, sql: str) -> int:
+        with self._reader() as conn, self._budget(conn, self.QUERY_TIMEOUT, self.QUERY_MAX_STEPS):
+            return conn.execute(_count_sql(sql)).fetchone()[0]
+
+    def iter_rows(self, sql: str, batch_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Yield a read-only query's rows as dicts, fetching `batch_size` (default
+        FETCH_BATCH_SIZE) at a time. The pooled read connection is held until the
+        iterator is exhausted or closed, which holds off reloads in the meantime.
+        Only the VM-step budget applies, since the caller sets the pace.
+        """
+        original_sql, _, _ = self._check_read_only(sql)
+        with self._reader() as conn, self._budget(conn, max_steps=self.QUERY_MAX_STEPS):
+            cur = conn.execute(original_sql)
+            try:
+                while True:
+                    batch = cur.fetchmany(batch_size or self.FETCH_BATCH_SIZE)
+                    if not batch:
+                        return
+                    for row in batch:
+                        yield dict(row)
+            finally:
+                cur.close()
+
+    def _schema_source(self, sample_rows: int) -> Tuple[List[Tuple[str, str]], List[Any]]:
+        """(name, declared type) pairs and the first `sample_rows` rows, for schema_text()"""
+        with self._reader() as conn:
+            info = conn.execute(f'PRAGMA table_info("{self.table_name}")').fetchall()
             cols = [(row[1], row[2]) for row in info]  # name, type
-            sample = self.conn.execute(f'SELECT * FROM "{self.table_name}" LIMIT {sample_rows}').fetchall()
-        
-        # Detect datetime columns by examining sample data
-        datetime_cols = set()
-        if sample:
-            for row in sample:
-                for col_name, _ in cols:
-                    val = row[col_name] if col_name in row.keys() else None
-                    if val and self._is_datetime(str(val)):
-                        datetime_cols.add(col_name)
-        
+            sample = conn.execute(f'SELECT * FROM "{self.table_name}" LIMIT {sample_rows}').fetchall()
+        return cols, sample
+
+    def column_stats(self, top_n: int = 3) -> Dict[str, Dict[str, Any]]:
+        """
+        Per-column non-null count, distinct count, min/max and most common values, gathered
+        in one pass over the table and cached until it changes. Columns with more than
+        STATS_MAX_DISTINCT distinct values report distinct as None and no top values.
+        """
+        if self._column_stats and self._column_stats[0] == self.table_version:
+            return self._column_stats[1]
+        version = self.table_version
+
+        names = [p.name for p in self.column_profiles]
+        counts = dict.fromkeys(names, 0)
+        low: Dict[str, tuple] = {}
+        high: Dict[str, tuple] = {}
+        counters: Dict[str, Optional[Counter]] = {name: Counter() for name in names}
+        for row in self.iter_rows(f'SELECT * FROM "{self.table_name}"'):
+            for name in names:
+                value = row[name]
+                if value is None or value == "":
+                    continue
+                counts[name] += 1
+                # Numbers sort before text, as in SQLite
+                key = (0, value) if isinstance(value, (int, float)) else (1, str(value))
+                if name not in low or key < low[name]:
+                    low[name] = key
+                if name not in high or key > high[name]:
+                    high[name] = key
+                counter = counters[name]
+                if counter is not None:
+                    counter[value] += 1
+                    if len(counter) > self.STATS_MAX_DISTINCT:
+                        counters[name] = None
+
+        stats = {}
+        for name in names:
+            counter = counters[name]
+            stats[name] = {
+                "count": counts[name],
+                "distinct": len(counter) if counter is not None else None,
+                "min": low[name][1] if name in low else None,
+                "max": high[name][1] if name in high else None,
+                "top": [[v, n] for v, n in counter.most_common(top_n)] if counter is not None else [],
+            }
+        self._column_stats = (version, stats)
+        return stats
+
+    def schema_text(self, sample_rows: int = 3, stats: Optional[bool] = None) -> str:
+        """
+        CREATE TABLE-style description with sample rows, built once per table version
+        (and kept in cached table files) rather than on every question. With `stats`
+        (default SQL_ENGINE_SCHEMA_STATS) it also lists column_stats() as hints.
+        """
+        stats = self.SCHEMA_STATS if stats is None else stats
+        key = (self.table_version, sample_rows, stats)
+        text = self._schema_cache.get(key)
+        if text is None:
+            text = self._build_schema_text(sample_rows, stats)
+            self._schema_cache = {k: v for k, v in self._schema_cache.items() if k[0] == self.table_version}
+            self._schema_cache[key] = text
+        return text
+
+    def _build_schema_text(self, sample_rows: int, stats: bool) -> str:
+        # build CREATE TABLE-ish schema description
+        cols, sample = self._schema_source(sample_rows)
+
+        # Datetime columns were identified when the table was profiled at load time
+        datetime_cols = {p.name for p in self.column_profiles if p.type == "DATETIME"}
+
         lines = [f'CREATE TABLE "{self.table_name}" (']
         for name, typ in cols:
             # Show DATETIME type for datetime columns in schema
@@ -202,6 +1115,20 @@ class SimpleSQLite:
         # Add a note about quoting column names with special characters
         lines.append("\n-- NOTE: Column names with special characters (parentheses, spaces, etc.) must be quoted with double quotes")
         lines.append(f'-- Example: SELECT "multiple_promotion_eligibility_(extra_flag)" FROM "{self.table_name}";')
+
+        if stats:
+            lines.append("\n-- Column stats (non-null count; distinct values; min..max; most common):")
+            for name, st in self.column_stats().items():
+                if not st["count"]:
+                    lines.append(f'--   "{name}": all NULL')
+                    continue
+                distinct = st["distinct"] if st["distinct"] is not None else f">{self.STATS_MAX_DISTINCT}"
+                parts = [f'{st["count"]} non-null', f"{distinct} distinct",
+                         f'{_short_repr(st["min"])}..{_short_repr(st["max"])}']
+                common = [f"{_short_repr(v)} ({n})" for v, n in st["top"] if n > 1]
+                if common:
+                    parts.append("top " + ", ".join(common))
+                lines.append(f'--   "{name}": ' + "; ".join(parts))
         
         if sample:
             lines.append("\n-- Sample rows:")
@@ -211,31 +1138,580 @@ class SimpleSQLite:
                 lines.append(str(as_dict).replace("'\"", '"').replace("\"'", '"'))
         return "\n".join(lines)
 
-def load_csv(path: str) -> List[Dict[str, Any]]:
-    with open(path, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        return list(reader)
+# SQLite date functions the LLM's SQL relies on, as DuckDB macros over the same ISO text
+# dates (the connection runs in UTC, matching SQLite). sqlite_ts() parses 'now' and ISO
+# strings, offsets included; sqlite_mod() applies one modifier ('start of month|year|day',
+# '+N unit', 'localtime'/'utc' as no-ops). Each public macro takes up to three modifiers.
+def _duckdb_macros() -> List[str]:
+    def ts(k: int) -> str:
+        expr = "sqlite_ts(t)"
+        for i in range(1, k + 1):
+            expr = f"sqlite_mod({expr}, m{i})"
+        return expr
 
-def load_xlsx(path: str) -> List[Dict[str, Any]]:
+    def overloads(lead: str, body) -> str:
+        return ", ".join(f"({', '.join(lead.split() + ['t'] + [f'm{i}' for i in range(1, k + 1)])}) AS {body(ts(k))}"
+                         for k in range(4))
+
+    return [
+        "CREATE MACRO sqlite_ts(t) AS CASE WHEN lower(CAST(t AS VARCHAR)) = 'now' "
+        "THEN CAST(current_timestamp AS TIMESTAMP) "
+        "ELSE CAST(TRY_CAST(CAST(t AS VARCHAR) AS TIMESTAMPTZ) AS TIMESTAMP) END",
+        "CREATE MACRO sqlite_mod(ts, m) AS CASE "
+        "WHEN lower(trim(m)) IN ('localtime', 'utc') THEN ts "
+        "WHEN lower(trim(m)) = 'start of month' THEN CAST(date_trunc('month', ts) AS TIMESTAMP) "
+        "WHEN lower(trim(m)) = 'start of year' THEN CAST(date_trunc('year', ts) AS TIMESTAMP) "
+        "WHEN lower(trim(m)) = 'start of day' THEN CAST(date_trunc('day', ts) AS TIMESTAMP) "
+        "ELSE ts + TRY_CAST(ltrim(trim(m), '+') AS INTERVAL) END",
+        "CREATE MACRO sqlite_datetime " + overloads("", lambda e: f"strftime({e}, '%Y-%m-%d %H:%M:%S')"),
+        "CREATE MACRO sqlite_date " + overloads("", lambda e: f"strftime({e}, '%Y-%m-%d')"),
+        "CREATE MACRO sqlite_strftime " + overloads("fmt", lambda e: f"strftime({e}, fmt)"),
+    ]
+
+_DUCKDB_REWRITES = [
+    # SQLite's LIKE ignores ASCII case; DuckDB's does not
+    (re.compile(r"\b(NOT\s+)?LIKE\b", re.IGNORECASE), lambda m: f"{m.group(1) or ''}ILIKE"),
+    (re.compile(r"\b(datetime|date|strftime)\s*\(", re.IGNORECASE), lambda m: f"sqlite_{m.group(1).lower()}("),
+]
+_DUCKDB_TYPES = {"INTEGER": "BIGINT", "REAL": "DOUBLE"}
+
+def to_duckdb_sql(sql: str) -> str:
+    """Rewrite SQLite-isms outside string literals so generated SQL runs unchanged on DuckDB"""
+    parts = re.split(r"('(?:[^']|'')*')", sql)
+    for i in range(0, len(parts), 2):
+        for pattern, replacement in _DUCKDB_REWRITES:
+            parts[i] = pattern.sub(replacement, parts[i])
+    return "".join(parts)
+
+class DuckDBTable(SimpleSQLite):
+    """
+    Columnar alternative to SimpleSQLite for aggregate-heavy questions, backed by an
+    in-memory DuckDB database. It keeps the SimpleSQLite surface (load_rows/load_tuples,
+    select, execute_safe_select, iter_rows, schema_text, query_metrics): column types
+    come from the same profile and DATETIME columns keep SQLite's ISO text form.
+    Generated SQL goes through to_duckdb_sql(), which covers case-insensitive LIKE and
+    datetime()/date()/strftime() with common modifiers, and integer division truncates
+    as in SQLite. Known differences from SQLite:
+      - unaliased expression columns are named by DuckDB (SUM(code) comes back as
+        "sum(code)", COUNT(*) as "count_star()"), so alias columns callers read by name;
+      - cells that do not fit a column's numeric type are loaded as NULL (TRY_CAST)
+        where SQLite keeps the text, e.g. 'N/A' in an INTEGER column, which also shows
+        in schema_text()'s sample rows;
+      - date arithmetic that overflows a month follows DuckDB's rules.
+    """
+
+    def __init__(self, table_name: str):
+        # Shares SimpleSQLite's query validation, converters, caching and stats,
+        # but none of its SQLite connections, so the base __init__ is not used
+        if duckdb is None:
+            raise RuntimeError("duckdb is not installed; use the SQLite backend")
+        self.table_name = table_name
+        self.db_path = None
+        self.conn = duckdb.connect(":memory:")
+        self.conn.execute("SET TimeZone = 'UTC'")
+        # SQLite treats NULL as the smallest value when sorting
+        self.conn.execute("SET default_null_order = 'nulls_first_on_asc_last_on_desc'")
+        # SQLite's integer / integer truncates (7/2 = 3, -7/2 = -3); DuckDB's would give 3.5
+        # (session-scoped unless GLOBAL, and queries run on per-query cursors)
+        self.conn.execute("SET GLOBAL integer_division = true")
+        for macro in _duckdb_macros():
+            self.conn.execute(macro)
+        self.lock = threading.Lock()
+        self.rw_lock = _ReadWriteLock()
+        self._reader_count = 0
+        self._stats_lock = threading.Lock()
+        self.query_stats = {"queries": 0, "wait_seconds": 0.0, "exec_seconds": 0.0, "max_wait_seconds": 0.0}
+        self.load_stats: Dict[str, Any] = {}
+        self.table_version = 0
+        # schema_text() output per (table_version, sample_rows, stats), and column_stats() per version
+        self._schema_cache: Dict[Tuple[int, int, bool], str] = {}
+        self._column_stats: Optional[Tuple[int, Dict[str, Dict[str, Any]]]] = None
+        self.result_cache = QueryResultCache(
+            ttl=float(os.getenv("SQL_ENGINE_RESULT_CACHE_TTL", "300")),
+            max_entries=int(os.getenv("SQL_ENGINE_RESULT_CACHE_MAX_ENTRIES", "256")),
+            max_rows=int(os.getenv("SQL_ENGINE_RESULT_CACHE_MAX_ROWS", "100000")),
+        )
+        self.column_profiles: List[ColumnProfile] = []
+        self.column_hits: Dict[str, int] = {}
+        self.indexed_columns: List[str] = []
+        self.attached: Dict[str, SimpleSQLite] = {}
+        self.source: Optional[Tuple[str, str]] = None
+
+    def load_tuples(self, cols: List[str], rows: Iterable[Sequence[Any]], batch_size: Optional[int] = None,
+                    sample_rows: Optional[int] = None):
+        """
+        Profile like SimpleSQLite, then spool converted rows to a temporary CSV that
+        DuckDB's native reader ingests in one pass; numeric columns use TRY_CAST, so
+        the few values the profile tolerates as non-numeric become NULL.
+        """
+        rows = iter(rows)
+        sample = list(islice(rows, sample_rows or self.TYPE_SAMPLE_ROWS))
+        if not sample:
+            raise ValueError("No rows to load")
+
+        self.column_profiles = profile_columns(cols, sample)
+        converters = [self._make_converter(p) for p in self.column_profiles]
+        select_list = ", ".join(
+            f'TRY_CAST("{p.name}" AS {_DUCKDB_TYPES[p.type]}) AS "{p.name}"' if p.type in _DUCKDB_TYPES
+            else f'"{p.name}"'
+            for p in self.column_profiles
+        )
+
+        start = time.perf_counter()
+        loaded = 0
+        fd, spool_path = tempfile.mkstemp(prefix=f"{_slug(self.table_name)}-", suffix=".csv")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(cols)
+                for batch in self._iter_batches(chain(sample, rows), converters, batch_size or self.LOAD_BATCH_SIZE):
+                    writer.writerows(tuple("\\N" if v is None else v for v in r) for r in batch)
+                    loaded += len(batch)
+            with self.rw_lock.write(), self.lock:
+                self.conn.execute(f'DROP TABLE IF EXISTS "{self.table_name}"')
+                self.conn.execute(
+                    f'CREATE TABLE "{self.table_name}" AS SELECT {select_list} FROM read_csv(?, header = true, '
+                    f"all_varchar = true, nullstr = '\\N', quote = '\"', escape = '\"')",
+                    [spool_path]
+                )
+                self.table_version += 1
+                self.result_cache.clear()
+        finally:
+            os.remove(spool_path)
+
+        elapsed = time.perf_counter() - start
+        self.load_stats = {
+            "rows": loaded,
+            "seconds": round(elapsed, 3),
+            "rows_per_sec": round(loaded / elapsed, 1) if elapsed > 0 else None,
+        }
+        logger.info('Loaded %d rows into DuckDB table "%s" in %.2fs (%s rows/sec)',
+                    loaded, self.table_name, elapsed, self.load_stats["rows_per_sec"])
+
+    @contextmanager
+    def _cursor(self, timeout: float = 0):
+        """A per-query DuckDB cursor under the read lock, interrupted once `timeout` passes"""
+        requested = time.perf_counter()
+        with self.rw_lock.read():
+            cur = self.conn.cursor()
+            acquired = time.perf_counter()
+            timer = threading.Timer(timeout, cur.interrupt) if timeout else None
+            if timer:
+                timer.daemon = True
+                timer.start()
+            try:
+                yield cur
+            except duckdb.InterruptException as e:
+                raise QueryTooExpensive("timeout", timeout, round(time.perf_counter() - acquired, 3)) from e
+            finally:
+                if timer:
+                    timer.cancel()
+                cur.close()
+                self._record_query(acquired - requested, time.perf_counter() - acquired)
+
+    def select(self, sql: str, max_rows: Optional[int] = None, max_bytes: Optional[int] = None) -> QueryResult:
+        """Same contract as SimpleSQLite.select(); only the wall-clock budget applies"""
+        original_sql, s, first_word = self._check_read_only(sql)
+        max_rows = self.MAX_RESULT_ROWS if max_rows is None else max_rows
+        max_bytes = self.MAX_RESULT_BYTES if max_bytes is None else max_bytes
+
+        cache_key = None
+        if self.result_cache.enabled and first_word in ("SELECT", "WITH") and not _NONDETERMINISTIC_RE.search(s):
+            cache_key = (normalize_sql(s), (self.table_version,), max_rows, max_bytes)
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                return replace(cached, columns=list(cached.columns), rows=list(cached.rows))
+
+        rows: List[Dict[str, Any]] = []
+        size = 0
+        truncated = False
+        with self._cursor(self.QUERY_TIMEOUT) as cur:
+            cur.execute(to_duckdb_sql(s))
+            col_names = [d[0] for d in cur.description]
+            while not truncated:
+                batch = cur.fetchmany(self.FETCH_BATCH_SIZE)
+                if not batch:
+                    break
+                for row in batch:
+                    row_size = _row_bytes(row)
+                    if len(rows) >= max_rows or size + row_size > max_bytes:
+                        truncated = True
+                        break
+                    rows.append(dict(zip(col_names, row)))
+                    size += row_size
+
+        counter = partial(self._count_rows, s) if truncated else None
+        result = QueryResult(col_names, rows, truncated=truncated, bytes=size, _counter=counter)
+        if cache_key is not None:
+            self.result_cache.put(cache_key, result)
+        return replace(result, rows=list(rows))
+
+    def _count_rows(self, sql: str) -> int:
+        with self._cursor(self.QUERY_TIMEOUT) as cur:
+            return cur.execute(_count_sql(to_duckdb_sql(sql))).fetchone()[0]
+
+    def iter_rows(self, sql: str, batch_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        _, s, _ = self._check_read_only(sql)
+        with self._cursor() as cur:
+            cur.execute(to_duckdb_sql(s))
+            col_names = [d[0] for d in cur.description]
+            while True:
+                batch = cur.fetchmany(batch_size or self.FETCH_BATCH_SIZE)
+                if not batch:
+                    return
+                for row in batch:
+                    yield dict(zip(col_names, row))
+
+    def _schema_source(self, sample_rows: int) -> Tuple[List[Tuple[str, str]], List[Any]]:
+        # Declared types as SimpleSQLite would store them, so schema_text() matches exactly
+        cols = [(p.name, "TEXT" if p.type == "DATETIME" else p.type) for p in self.column_profiles]
+        with self._cursor() as cur:
+            cur.execute(f'SELECT * FROM "{self.table_name}" LIMIT {int(sample_rows)}')
+            names = [d[0] for d in cur.description]
+            sample = [dict(zip(names, r)) for r in cur.fetchall()]
+        return cols, sample
+
+    def create_indexes(self, columns: Iterable[str]) -> List[str]:
+        # Columnar scans with zone maps make the SQLite index advisor unnecessary
+        return []
+
+    def attach(self, other: SimpleSQLite):
+        raise ValueError("Cross-table queries need the SQLite backend")
+
+    def close(self):
+        with self.rw_lock.write(), self.lock:
+            self.conn.close()
+
+def _fit_row(row: Sequence[Any], width: int) -> tuple:
+    """Pad short rows with None and drop extra cells so every row matches the header"""
+    if len(row) == width:
+        return tuple(row)
+    return tuple(row[:width]) + (None,) * (width - len(row))
+
+def iter_csv(path: str) -> Tuple[List[str], Iterator[tuple]]:
+    """Return (headers, row tuple iterator) without reading the whole file"""
+    # utf-8-sig drops the BOM Excel writes, which would otherwise prefix the first column name
+    f = open(path, "r", encoding="utf-8-sig", newline="")
+    reader = csv.reader(f)
+    try:
+        headers = next(reader)
+    except StopIteration:
+        f.close()
+        raise ValueError(f"{path} is empty")
+
+    def rows():
+        with f:
+            width = len(headers)
+            for r in reader:
+                # Blank lines come back as []; csv.DictReader skipped them, so do the same
+                if not r:
+                    continue
+                yield _fit_row(r, width)
+
+    return headers, rows()
+
+def _open_workbook(path: str):
     if openpyxl is None:
         raise RuntimeError("openpyxl is not installed; cannot read .xlsx")
-    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
-    ws = wb[wb.sheetnames[0]]
-    rows = list(ws.iter_rows(values_only=True))
-    headers = [str(h) for h in rows[0]]
-    out = []
-    for r in rows[1:]:
-        out.append({h: v for h, v in zip(headers, r)})
-    return out
-
-def build_engine_from_file(path: str, table_name: str) -> SimpleSQLite:
+    return openpyxl.load_workbook(path, read_only=True, data_only=True)
+
+def xlsx_sheet_names(path: str) -> List[str]:
+    wb = _open_workbook(path)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+def iter_xlsx(path: str, sheet: Optional[str] = None) -> Tuple[List[str], Iterator[tuple]]:
+    """Return (headers, row tuple iterator) for `sheet` (default the first), streamed in read-only mode"""
+    wb = _open_workbook(path)
+    ws = wb[sheet or wb.sheetnames[0]]
+    it = ws.iter_rows(values_only=True)
+    first = next(it, None)
+    if first is None:
+        wb.close()
+        raise ValueError(f"{path} has no rows")
+    headers = [str(h) for h in first]
+
+    def rows():
+        try:
+            width = len(headers)
+            for r in it:
+                yield _fit_row(r, width)
+        finally:
+            wb.close()
+
+    return headers, rows()
+
+XLSX_EXTENSIONS = (".xlsx", ".xlsm", ".xltx", ".xltm")
+
+def iter_file(path: str, sheet: Optional[str] = None) -> Tuple[List[str], Iterator[tuple]]:
     _, ext = os.path.splitext(path.lower())
     if ext == ".csv":
-        rows = load_csv(path)
-    elif ext in (".xlsx", ".xlsm", ".xltx", ".xltm"):
-        rows = load_xlsx(path)
-    else:
-        raise ValueError("Unsupported file type; use .csv or .xlsx")
-    engine = SimpleSQLite(table_name=table_name)
-    engine.load_rows(rows)
+        return iter_csv(path)
+    elif ext in XLSX_EXTENSIONS:
+        return iter_xlsx(path, sheet)
+    raise ValueError("Unsupported file type; use .csv or .xlsx")
+
+def read_headers(path: str, sheet: Optional[str] = None) -> List[str]:
+    """Header row only, without loading the table"""
+    headers, rows = iter_file(path, sheet)
+    # Start and close the generator so its file or workbook is released now
+    next(rows, None)
+    rows.close()
+    return headers
+
+def load_csv(path: str) -> List[Dict[str, Any]]:
+    headers, rows = iter_csv(path)
+    return [dict(zip(headers, r)) for r in rows]
+
+def load_xlsx(path: str) -> List[Dict[str, Any]]:
+    headers, rows = iter_xlsx(path)
+    return [dict(zip(headers, r)) for r in rows]
+
+def _stat_key(path: str) -> str:
+    st = os.stat(path)
+    return f"{st.st_mtime_ns}-{st.st_size}"
+
+def file_fingerprint(path: str) -> str:
+    """mtime + size + content hash of a source file, used to key cached table files"""
+    digest = hashlib.sha256(f"{CACHE_FORMAT_VERSION}|{os.path.abspath(path)}|".encode("utf-8"))
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return f"{_stat_key(path)}:{digest.hexdigest()}"
+
+def _cache_prefix(path: str, table_name: str, cache_dir: str) -> str:
+    safe_table = re.sub(r"[^A-Za-z0-9_]+", "_", table_name)
+    path_id = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(cache_dir, f"{safe_table}-{path_id}-")
+
+def _building_elsewhere(path: str) -> bool:
+    """True for a .building-<pid> table file whose builder process is still alive"""
+    m = re.search(r"\.building-(\d+)$", path)
+    if not m:
+        return False
+    try:
+        os.kill(int(m.group(1)), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # alive, owned by another user
+    return True
+
+def _stat_source(path: str) -> Tuple[str, str]:
+    """SimpleSQLite.source for a table loaded without the content hash; source_changed() only needs the stat part"""
+    return os.path.abspath(path), f"{_stat_key(path)}:"
+
+def _load_from_source(path: str, table_name: str, db_path: Optional[str] = None,
+                      sheet: Optional[str] = None) -> SimpleSQLite:
+    # Stat before reading, so a write during the load still counts as a change
+    source = _stat_source(path)
+    headers, rows = iter_file(path, sheet)
+    engine = SimpleSQLite(table_name=table_name, db_path=db_path)
+    engine.load_tuples(headers, rows)
+    engine.source = source
+    return engine
+
+def build_engine_from_file(path: str, table_name: str, cache_dir: Optional[str] = None,
+                           index_sqls: Optional[Iterable[str]] = None, sheet: Optional[str] = None,
+                           backend: Optional[str] = None) -> SimpleSQLite:
+    """
+    Load a CSV/XLSX file as a SQLite table. With `cache_dir` (or SQL_ENGINE_CACHE_DIR)
+    the table is materialized once into an on-disk SQLite file keyed by the source's
+    path, mtime, size and content hash, and reused across restarts until the source changes.
+    `index_sqls` (e.g. the configured snippets' SQL) pre-creates indexes for the columns
+    those queries filter, join or sort on. `sheet` picks a workbook sheet other than the first.
+    `backend` (default SQL_ENGINE_BACKEND) "duckdb" loads into an in-memory DuckDBTable
+    instead, without the on-disk cache, falling back to SQLite if duckdb is not installed.
+    """
+    if (backend or BACKEND).lower() == "duckdb":
+        if duckdb is not None:
+            source = _stat_source(path)
+            headers, rows = iter_file(path, sheet)
+            engine = DuckDBTable(table_name)
+            engine.load_tuples(headers, rows)
+            engine.source = source
+            return engine
+        logger.warning("duckdb is not installed; falling back to the SQLite backend")
+
+    engine = _open_engine(path, table_name, cache_dir, sheet)
+    if index_sqls:
+        engine.index_snippet_columns(index_sqls)
     return engine
+
+def _open_engine(path: str, table_name: str, cache_dir: Optional[str], sheet: Optional[str] = None) -> SimpleSQLite:
+    cache_dir = cache_dir if cache_dir is not None else CACHE_DIR
+    if not cache_dir:
+        return _load_from_source(path, table_name, sheet=sheet)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    fingerprint = file_fingerprint(path)
+    prefix = _cache_prefix(path, table_name, cache_dir)
+    db_path = f"{prefix}{fingerprint.split(':', 1)[1][:16]}.sqlite3"
+
+    if os.path.exists(db_path):
+        try:
+            engine = SimpleSQLite.open_file(db_path, table_name)
+            logger.info("Reusing cached table file %s", db_path)
+            return engine
+        except Exception as e:
+            logger.warning("Cached table file %s is unusable (%s); rebuilding", db_path, e)
+            os.remove(db_path)
+
+    # Build into a temporary file and swap it in, so a crash never leaves a half-built cache
+    tmp_path = f"{db_path}.building-{os.getpid()}"
+    engine = _load_from_source(path, table_name, db_path=tmp_path, sheet=sheet)
+    engine.source = (os.path.abspath(path), fingerprint)
+    # Build the schema description now so it is stored with the table
+    engine.schema_text()
+    engine.save_meta()
+    engine.close()
+    os.replace(tmp_path, db_path)
+
+    # Drop table files built from older versions of this source, but not another
+    # process's build in progress
+    for stale in glob.glob(f"{glob.escape(prefix)}*.sqlite3*"):
+        if not stale.startswith(db_path) and not _building_elsewhere(stale):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+    return SimpleSQLite.open_file(db_path, table_name)
+
+@dataclass
+class TableSource:
+    table_name: str
+    file_path: str
+    sheet: Optional[str] = None
+
+def _slug(text: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_]+", "_", text).strip("_").lower() or "table"
+
+def expand_sources(sources: Iterable[Dict[str, Any]]) -> List[TableSource]:
+    """
+    One TableSource per CSV and per workbook sheet from {"file_path", "table_name", "sheet"}
+    dicts. A workbook without an explicit sheet contributes every sheet: the first keeps
+    table_name (default: the file name), later ones become <table_name>_<sheet>.
+    """
+    tables: List[TableSource] = []
+    for src in sources:
+        path = src["file_path"]
+        name = src.get("table_name") or _slug(os.path.splitext(os.path.basename(path))[0])
+        if src.get("sheet") or not path.lower().endswith(XLSX_EXTENSIONS):
+            tables.append(TableSource(name, path, src.get("sheet")))
+            continue
+        for i, sheet in enumerate(xlsx_sheet_names(path)):
+            tables.append(TableSource(name if i == 0 else f"{name}_{_slug(sheet)}", path, sheet))
+    return tables
+
+class SQLCatalog:
+    """
+    Several CSV/XLSX tables behind the SimpleSQLite query interface. Each table is
+    built (through build_engine_from_file, so the on-disk cache applies) the first
+    time a query or schema request references it; a query over several tables runs
+    on the first one's engine with the others ATTACHed.
+    """
+
+    def __init__(self, sources: List[TableSource], cache_dir: Optional[str] = None,
+                 index_sqls: Optional[Iterable[str]] = None):
+        if not sources:
+            raise ValueError("SQLCatalog needs at least one table source")
+        self.sources: Dict[str, TableSource] = {s.table_name: s for s in sources}
+        self.cache_dir = cache_dir
+        self.index_sqls = list(index_sqls or [])
+        self._engines: Dict[str, SimpleSQLite] = {}
+        self._headers: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_sources(cls, sources: Iterable[Dict[str, Any]], **kwargs) -> "SQLCatalog":
+        """Build from config dicts, e.g. AppConfig.data.sources()"""
+        return cls(expand_sources(sources), **kwargs)
+
+    @property
+    def table_names(self) -> List[str]:
+        return list(self.sources)
+
+    def engine(self, table_name: str) -> SimpleSQLite:
+        """The table's engine, loading it on first use and reloading it once its source file changes"""
+        if table_name not in self.sources:
+            raise ValueError(f"Unknown table: {table_name}")
+        with self._lock:
+            current = self._engines.get(table_name)
+            if current is not None and current.source_changed():
+                # Queries already running keep the old engine; later lookups get the new one
+                logger.info('Source of "%s" changed; reloading it', table_name)
+                del self._engines[table_name]
+            if table_name not in self._engines:
+                src = self.sources[table_name]
+                self._engines[table_name] = build_engine_from_file(
+                    src.file_path, table_name, cache_dir=self.cache_dir,
+                    index_sqls=self.index_sqls, sheet=src.sheet
+                )
+            return self._engines[table_name]
+
+    def headers(self, table_name: str) -> List[str]:
+        """Column names, read from the header row alone while the table is not loaded yet"""
+        engine = self._engines.get(table_name)
+        if engine is not None:
+            return [p.name for p in engine.column_profiles]
+        if table_name not in self._headers:
+            src = self.sources[table_name]
+            self._headers[table_name] = read_headers(src.file_path, src.sheet)
+        return self._headers[table_name]
+
+    def referenced_tables(self, sql: str) -> List[str]:
+        """Catalog tables named in `sql`, in order of first appearance"""
+        by_lower = {name.lower(): name for name in self.sources}
+        found: List[str] = []
+        for m in _IDENT_RE.finditer(_STRING_LITERAL_RE.sub("''", sql)):
+            name = by_lower.get(next(g for g in m.groups() if g is not None).lower())
+            if name and name not in found:
+                found.append(name)
+        return found
+
+    def relevant_tables(self, question: str, max_tables: int = 3) -> List[str]:
+        """
+        Tables sharing words with `question`, best first: a table-name word counts twice,
+        a column-name word once. Falls back to the first table when nothing matches.
+        """
+        text = question.lower()
+        words = set(_TERM_RE.findall(text))
+
+        def hits(terms: Iterable[str]) -> int:
+            return sum(1 for t in set(terms) if t in words or (_THAI_RE.search(t) and t in text))
+
+        scored = []
+        for order, name in enumerate(self.sources):
+            name_terms = _TERM_RE.findall(name.lower())
+            column_terms = [t for h in self.headers(name) for t in _TERM_RE.findall(h.lower())]
+            score = 2 * hits(name_terms) + hits(column_terms)
+            if score:
+                scored.append((-score, order, name))
+        return [name for _, _, name in sorted(scored)[:max_tables]] or self.table_names[:1]
+
+    def schema_text(self, question: Optional[str] = None, sample_rows: int = 3) -> str:
+        """Schema of the tables relevant to `question` (every table when none is given)"""
+        names = self.relevant_tables(question) if question else self.table_names
+        return "\n\n".join(self.engine(name).schema_text(sample_rows) for name in names)
+
+    def select(self, sql: str, **kwargs) -> QueryResult:
+        names = self.referenced_tables(sql) or self.table_names[:1]
+        primary = self.engine(names[0])
+        for name in names[1:]:
+            primary.attach(self.engine(name))
+        return primary.select(sql, **kwargs)
+
+    def execute_safe_select(self, sql: str) -> QueryResult:
+        return self.select(sql)
+
+    def query_metrics(self) -> Dict[str, Any]:
+        return {name: engine.query_metrics() for name, engine in self._engines.items()}
+
+    def close(self):
+        with self._lock:
+            for engine in self._engines.values():
+                engine.close()
+            self._engines.clear()
@@ -41,9 +41,9 @@ async function reprocessDocument252() {
       return;
     }
 
-    // Process content with Thai segmentation
+    // Process content with Thai segmentation, one batch call over all paragraphs
     console.log('🇹🇭 Processing content with Thai text segmentation...');
-    const processedContent = await thaiTextProcessor.processForSearch(freshContent);
+    const processedContent = await thaiTextProcessor.processDocumentForSearch(freshContent);
 
     console.log(`📝 Content processing completed:`);
     console.log(`   - Original length: ${freshContent.length} characters`);
@@ -1,18 +1,227 @@
-import { exec } from 'child_process';
+import { exec, spawn, ChildProcessWithoutNullStreams } from 'child_process';
 import { promisify } from 'util';
+import readline from 'readline';
+import os from 'os';
 import fs from 'fs';
 import path from 'path';
 
 const execAsync = promisify(exec);
 
+// Texts larger than this are segmented paragraph by paragraph in streaming mode
+const STREAMING_THRESHOLD_CHARS = 1024 * 1024;
+
+// Stream and batch runs get the one-shot script's 30 second limit plus this much per MB of input
+const SEGMENTER_TIMEOUT_MS = 30000;
+const SEGMENTER_TIMEOUT_MS_PER_MB = 30000;
+
+function segmenterTimeoutMs(chars: number): number {
+  return SEGMENTER_TIMEOUT_MS + Math.ceil(chars / (1024 * 1024)) * SEGMENTER_TIMEOUT_MS_PER_MB;
+}
+
+interface SegmentationResult {
+  success: boolean;
+  segmented_text: string;
+  original_length?: number;
+  segmented_length?: number;
+  error?: string;
+}
+
+interface PendingSegmentation {
+  resolve: (result: SegmentationResult) => void;
+  reject: (error: Error) => void;
+  timer: NodeJS.Timeout;
+}
+
 export class ThaiTextProcessor {
   private scriptPath: string;
+  private daemon: ChildProcessWithoutNullStreams | null = null;
+  private pending = new Map<number, PendingSegmentation>();
+  private nextRequestId = 1;
 
   constructor() {
     // Use the persistent Python file
     this.scriptPath = path.join(process.cwd(), 'temp', 'thai_segmenter.py');
   }
 
+  /**
+   * Start (or reuse) the long-lived segmenter process so PyThaiNLP is loaded once
+   */
+  private getDaemon(): ChildProcessWithoutNullStreams {
+    if (this.daemon) {
+      return this.daemon;
+    }
+
+    const workers = process.env.THAI_SEGMENTER_WORKERS || '1';
+    const daemon = spawn('python3', [this.scriptPath, '--serve', '--workers', workers]);
+    console.log(`🇹🇭 Started Thai segmenter daemon (pid ${daemon.pid}, ${workers} worker(s))`);
+
+    readline.createInterface({ input: daemon.stdout }).on('line', (line) => {
+      let response: SegmentationResult & { id?: number };
+      try {
+        response = JSON.parse(line);
+      } catch (parseError) {
+        console.warn('⚠️ Thai segmenter daemon sent invalid JSON:', line.substring(0, 200));
+        return;
+      }
+
+      const request = response.id !== undefined ? this.pending.get(response.id) : undefined;
+      if (!request) return;
+
+      clearTimeout(request.timer);
+      this.pending.delete(response.id!);
+      request.resolve(response);
+    });
+
+    daemon.stderr.on('data', (data) => {
+      const message = data.toString().trim();
+      if (message && !message.startsWith('DEBUG')) {
+        console.warn('⚠️ PythaiNLP warning:', message);
+      }
+    });
+
+    daemon.on('error', (error) => this.shutdownDaemon(daemon, `Thai segmenter daemon error: ${error.message}`));
+    daemon.on('exit', (code) => this.shutdownDaemon(daemon, `Thai segmenter daemon exited with code ${code}`));
+    // Writing to a daemon that just died emits EPIPE here; unhandled, it would crash the server
+    daemon.stdin.on('error', (error) => this.shutdownDaemon(daemon, `Thai segmenter daemon stdin error: ${error.message}`));
+
+    this.daemon = daemon;
+    return daemon;
+  }
+
+  /**
+   * Forget a daemon and reject everything still waiting on it, so the next call
+   * respawns it; a daemon that is still running is killed
+   */
+  private shutdownDaemon(daemon: ChildProcessWithoutNullStreams, reason: string): void {
+    if (this.daemon !== daemon) return;
+    this.daemon = null;
+    for (const [id, request] of this.pending) {
+      clearTimeout(request.timer);
+      request.reject(new Error(reason));
+      this.pending.delete(id);
+    }
+    if (daemon.exitCode === null && daemon.signalCode === null) {
+      daemon.kill();
+    }
+  }
+
+  /**
+   * Segment text through the long-lived daemon (one JSON line per request)
+   */
+  private segmentViaDaemon(text: string): Promise<SegmentationResult> {
+    return new Promise((resolve, reject) => {
+      const daemon = this.getDaemon();
+      const id = this.nextRequestId++;
+
+      const timer = setTimeout(() => {
+        this.pending.delete(id);
+        reject(new Error('Thai segmenter daemon timed out'));
+        // The daemon is still busy with the stalled text and every later request
+        // would queue behind it, so kill it and let the next call start a fresh one
+        this.shutdownDaemon(daemon, 'Thai segmenter daemon restarted after a timeout');
+      }, 30000); // 30 second timeout, same as the one-shot script
+
+      this.pending.set(id, { resolve, reject, timer });
+      daemon.stdin.write(JSON.stringify({ id, text }) + '\n');
+    });
+  }
+
+  /**
+   * Segment a very large text with the script's streaming mode, which emits one
+   * JSONL record per paragraph so neither side holds one giant JSON string
+   */
+  private segmentViaStream(text: string): Promise<SegmentationResult> {
+    return new Promise((resolve, reject) => {
+      const child = spawn('python3', [this.scriptPath, '--stream']);
+      const segmentedParagraphs: string[] = [];
+      let summary: { original_length?: number; segmented_length?: number } = {};
+
+      readline.createInterface({ input: child.stdout }).on('line', (line) => {
+        try {
+          const record = JSON.parse(line);
+          if (record.done) {
+            summary = record;
+          } else if (record.segmented_text) {
+            segmentedParagraphs[record.id] = record.segmented_text;
+          }
+        } catch (parseError) {
+          console.warn('⚠️ Thai stream segmenter sent invalid JSON:', line.substring(0, 200));
+        }
+      });
+
+      child.stderr.on('data', (data) => {
+        const message = data.toString().trim();
+        if (message && !message.startsWith('DEBUG')) {
+          console.warn('⚠️ PythaiNLP warning:', message);
+        }
+      });
+
+      // A hung child would otherwise keep the caller (and its one-shot fallback) waiting forever
+      const timeoutMs = segmenterTimeoutMs(text.length);
+      const timer = setTimeout(() => {
+        reject(new Error(`Thai stream segmenter timed out after ${timeoutMs} ms`));
+        child.kill();
+      }, timeoutMs);
+
+      child.on('error', reject);
+      // EPIPE if the segmenter dies mid-write; unhandled, it would crash the server
+      child.stdin.on('error', (error) => {
+        reject(error);
+        child.kill();
+      });
+      child.on('close', (code) => {
+        clearTimeout(timer);
+        if (code !== 0) {
+          reject(new Error(`Thai stream segmenter exited with code ${code}`));
+          return;
+        }
+        const segmentedText = segmentedParagraphs.filter(Boolean).join('\n');
+        resolve({
+          success: true,
+          segmented_text: segmentedText,
+          original_length: summary.original_length ?? text.length,
+          segmented_length: segmentedText.length
+        });
+      });
+
+      child.stdin.end(text, 'utf8');
+    });
+  }
+
+  /**
+   * Segment text by running the script once (fallback when the daemon is unavailable)
+   */
+  private async segmentViaScript(text: string): Promise<SegmentationResult> {
+    // Write input to temporary file
+    const tempDir = path.join(process.cwd(), 'temp');
+    await fs.promises.mkdir(tempDir, { recursive: true });
+
+    const inputPath = path.join(tempDir, 'input.txt');
+    await fs.promises.writeFile(inputPath, text, 'utf8');
+
+    try {
+      // Execute Python script with input file
+      const { stdout, stderr } = await execAsync(`python3 "${this.scriptPath}" < "${inputPath}"`, {
+        timeout: 30000, // 30 second timeout
+        maxBuffer: 1024 * 1024 * 10 // 10MB buffer
+      });
+
+      if (stderr) {
+        console.warn('⚠️ PythaiNLP warning:', stderr);
+      }
+
+      // Parse the JSON response
+      return JSON.parse(stdout);
+    } finally {
+      // Clean up temp input file
+      try {
+        await fs.promises.unlink(inputPath);
+      } catch (cleanupError) {
+        // Ignore cleanup errors
+      }
+    }
+  }
+
   /**
    * Check if text contains significant Thai content
    */
@@ -44,26 +253,16 @@ export class ThaiTextProcessor {
     try {
       console.log(`🇹🇭 Processing Thai text segmentation (${text.length} characters)...`);
 
-      // Write input to temporary file
-      const tempDir = path.join(process.cwd(), 'temp');
-      await fs.promises.mkdir(tempDir, { recursive: true });
-
-      const inputPath = path.join(tempDir, 'input.txt');
-      await fs.promises.writeFile(inputPath, text, 'utf8');
-
-      // Execute Python script with input file
-      const { stdout, stderr } = await execAsync(`python3 "${this.scriptPath}" < "${inputPath}"`, {
-        timeout: 30000, // 30 second timeout
-        maxBuffer: 1024 * 1024 * 10 // 10MB buffer
-      });
-
-      if (stderr) {
-        console.warn('⚠️ PythaiNLP warning:', stderr);
+      let result: SegmentationResult;
+      try {
+        result = text.length > STREAMING_THRESHOLD_CHARS
+          ? await this.segmentViaStream(text)
+          : await this.segmentViaDaemon(text);
+      } catch (segmenterError) {
+        console.warn('⚠️ Thai segmenter unavailable, falling back to one-shot script:', segmenterError);
+        result = await this.segmentViaScript(text);
       }
 
-      // Parse the JSON response
-      const result = JSON.parse(stdout);
-
       if (result.success) {
         const segmentedText = result.segmented_text;
         console.log(`✅ Thai segmentation completed:`);
@@ -71,13 +270,6 @@ export class ThaiTextProcessor {
         console.log(`   - Segmented: ${result.segmented_length} characters`);
         console.log(`   - Sample: "${segmentedText.substring(0, 200)}..."`);
 
-        // Clean up temp input file
-        try {
-          await fs.promises.unlink(inputPath);
-        } catch (cleanupError) {
-          // Ignore cleanup errors
-        }
-
         return segmentedText || text;
       } else {
         console.error('❌ Thai segmentation failed:', result.error);
@@ -90,6 +282,80 @@ export class ThaiTextProcessor {
     }
   }
 
+  /**
+   * Segment many texts with a single segmenter call (batch mode, fanned across
+   * worker processes). Texts without significant Thai content are returned as-is
+   * and results keep the input order. With checkThai false every non-blank text is
+   * segmented, for callers that already checked the document they came from.
+   */
+  async segmentThaiTextBatch(texts: string[], { checkThai = true }: { checkThai?: boolean } = {}): Promise<string[]> {
+    const results = [...texts];
+    const items = texts
+      .map((text, id) => ({ id, text }))
+      .filter(({ text }) => text && text.trim().length > 0 && (!checkThai || this.containsThaiText(text)));
+
+    if (items.length === 0) {
+      return results;
+    }
+
+    try {
+      const workers = process.env.THAI_SEGMENTER_WORKERS || String(os.cpus().length);
+      console.log(`🇹🇭 Batch segmenting ${items.length}/${texts.length} Thai texts with ${workers} worker(s)...`);
+
+      await new Promise<void>((resolve, reject) => {
+        const child = spawn('python3', [this.scriptPath, '--batch', '--workers', workers]);
+
+        readline.createInterface({ input: child.stdout }).on('line', (line) => {
+          try {
+            const result: SegmentationResult & { id: number } = JSON.parse(line);
+            if (result.success && result.segmented_text) {
+              results[result.id] = result.segmented_text;
+            } else if (!result.success) {
+              console.error(`❌ Thai segmentation failed for item ${result.id}:`, result.error);
+            }
+          } catch (parseError) {
+            console.warn('⚠️ Thai batch segmenter sent invalid JSON:', line.substring(0, 200));
+          }
+        });
+
+        child.stderr.on('data', (data) => {
+          const message = data.toString().trim();
+          if (message && !message.startsWith('DEBUG')) {
+            console.warn('⚠️ PythaiNLP warning:', message);
+          }
+        });
+
+        const timeoutMs = segmenterTimeoutMs(items.reduce((total, { text }) => total + text.length, 0));
+        const timer = setTimeout(() => {
+          reject(new Error(`Thai batch segmenter timed out after ${timeoutMs} ms`));
+          child.kill();
+        }, timeoutMs);
+
+        child.on('error', reject);
+        // EPIPE if the segmenter dies mid-write; unhandled, it would crash the server
+        child.stdin.on('error', (error) => {
+          reject(error);
+          child.kill();
+        });
+        child.on('close', (code) => {
+          clearTimeout(timer);
+          code === 0 ? resolve() : reject(new Error(`Thai batch segmenter exited with code ${code}`));
+        });
+
+        for (const item of items) {
+          child.stdin.write(JSON.stringify(item) + '\n');
+        }
+        child.stdin.end();
+      });
+
+      console.log(`✅ Thai batch segmentation completed for ${items.length} texts`);
+    } catch (error) {
+      console.error('❌ Thai batch segmentation error:', error);
+    }
+
+    return results;
+  }
+
   /**
    * Process text for optimal search indexing
    * - Segments Thai text
@@ -103,23 +369,45 @@ export class ThaiTextProcessor {
 
     try {
       // First, segment Thai text
-      let processedText = await this.segmentThaiText(text);
-
-      // Clean up whitespace while preserving Thai word boundaries from segmentation
-      processedText = processedText
-        .replace(/\n\s*\n/g, '\n') // Replace multiple newlines with single newline
-        .replace(/^\s+|\s+$/g, '') // Trim leading and trailing whitespace
-        .trim();
-      
-      // DO NOT collapse multiple spaces - they are Thai word boundaries!
+      const processedText = await this.segmentThaiText(text);
 
-      return processedText;
+      return this.cleanUpForSearch(processedText);
 
     } catch (error) {
       console.error('❌ Text processing error:', error);
       return text; // Return original text on error
     }
   }
+
+  /**
+   * processForSearch for a whole document, segmenting its paragraphs in one batch
+   * call. The 10% Thai check applies to the document as a whole, as in
+   * processForSearch, so both paths segment the same documents.
+   */
+  async processDocumentForSearch(text: string): Promise<string> {
+    if (!text || text.trim().length === 0) {
+      return text;
+    }
+    if (!this.containsThaiText(text)) {
+      console.log('📝 Text does not contain significant Thai content, skipping segmentation');
+      return this.cleanUpForSearch(text);
+    }
+
+    const paragraphs = text.split(/\n\s*\n/);
+    const segmentedParagraphs = await this.segmentThaiTextBatch(paragraphs, { checkThai: false });
+    return this.cleanUpForSearch(segmentedParagraphs.join('\n'));
+  }
+
+  /**
+   * Clean up whitespace while preserving Thai word boundaries from segmentation
+   */
+  private cleanUpForSearch(text: string): string {
+    // DO NOT collapse multiple spaces - they are Thai word boundaries!
+    return text
+      .replace(/\n\s*\n/g, '\n') // Replace multiple newlines with single newline
+      .replace(/^\s+|\s+$/g, '') // Trim leading and trailing whitespace
+      .trim();
+  }
 }
 
 export const thaiTextProcessor = new ThaiTextProcessor();
\ No newline at end of file
@@ -1,25 +1,99 @@
-
+import os
 import sys
 import json
 import io
+import re
+import time
+import hashlib
+import sqlite3
+import argparse
+import multiprocessing
+from functools import partial
+import pythainlp
 from pythainlp import word_tokenize, sent_tokenize
 from pythainlp.corpus.common import thai_stopwords
 
-# Ensure proper UTF-8 encoding for stdin
-sys.stdin = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+# Tokenizers in order of preference
+TOKENIZER_ENGINES = ['newmm', 'longest', 'attacut', 'deepcut']
+
+# Remembers which engine passed the probe, per PyThaiNLP version, across runs
+ENGINE_CACHE_PATH = os.environ.get(
+    "THAI_SEGMENTER_ENGINE_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".thai_segmenter_engine.json")
+)
+
+# Only whitespace-delimited spans containing Thai go to the dictionary tokenizer,
+# whole, so abbreviations like "พ.ศ." stay intact; other spans are split by
+# NON_THAI_TOKEN, newmm's own non-Thai pattern minus its whitespace alternatives.
+# Other engines treat non-Thai text differently, so they always take the full path
+# (set THAI_SEGMENTER_FAST_PATH=off to send whole sentences to PyThaiNLP)
+FAST_PATH = os.environ.get("THAI_SEGMENTER_FAST_PATH", "on").lower() not in ("off", "0", "false")
+SPAN = re.compile(r"\S+")
+THAI_CHAR = re.compile(r"[\u0E00-\u0E7F]")
+NON_THAI_TOKEN = re.compile(r"[-a-zA-Z]+|\d+(?:[,.]\d+)*|[^\u0E00-\u0E7F\s]+")
+
+# Items handed to each pool worker at a time in batch mode
+BATCH_CHUNKSIZE = 8
+
+# Largest piece of text segmented at once in streaming mode
+STREAM_MAX_CHUNK_CHARS = int(os.environ.get("THAI_SEGMENTER_STREAM_CHUNK_CHARS", "20000"))
+
+# Content-addressed segmentation result cache (set THAI_SEGMENTER_CACHE=off to disable)
+RESULT_CACHE_PATH = os.environ.get(
+    "THAI_SEGMENTER_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".thai_segmenter_cache.sqlite3")
+)
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("THAI_SEGMENTER_CACHE_MAX_ENTRIES", "50000"))
+
+_selected_engine = None
+
+def _load_cached_engine():
+    """Return the engine recorded in the capability file for this PyThaiNLP version, if any"""
+    try:
+        with open(ENGINE_CACHE_PATH, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached.get("pythainlp_version") == pythainlp.__version__:
+            return cached.get("engine")
+    except Exception:
+        pass
+    return None
+
+def _save_cached_engine(engine):
+    try:
+        with open(ENGINE_CACHE_PATH, 'w', encoding='utf-8') as f:
+            json.dump({"pythainlp_version": pythainlp.__version__, "engine": engine}, f)
+    except Exception as e:
+        print(f"DEBUG: Could not write engine cache {ENGINE_CACHE_PATH}: {e}", file=sys.stderr)
 
-def segment_thai_text(text):
+def select_engine(preferred=None):
     """
-    Segment Thai text using PythaiNLP
-    Returns segmented text with proper word boundaries
+    Resolve the tokenizer engine once per process.
+    Order: explicit argument / --engine, THAI_SEGMENTER_ENGINE env var,
+    the on-disk capability file, then a one-off probe of TOKENIZER_ENGINES.
     """
-    # Try different tokenizers in order of preference
-    tokenizer_engines = ['newmm', 'longest', 'attacut', 'deepcut']
-    
+    global _selected_engine
+
+    if preferred:
+        _selected_engine = preferred
+        return _selected_engine
+
+    if _selected_engine:
+        return _selected_engine
+
+    if os.environ.get("THAI_SEGMENTER_ENGINE"):
+        _selected_engine = os.environ["THAI_SEGMENTER_ENGINE"]
+        return _selected_engine
+
+    engine = _load_cached_engine()
+    if engine:
+        print(f"DEBUG: Using cached tokenizer engine: {engine}", file=sys.stderr)
+        _selected_engine = engine
+        return _selected_engine
+
     selected_engine = 'newmm'  # default
-    
+
     # Test which tokenizer is available
-    for engine in tokenizer_engines:
+    for engine in TOKENIZER_ENGINES:
         try:
             # Test tokenizer with a simple word
             word_tokenize("ทดสอบ", engine=engine)
@@ -28,9 +102,39 @@ def segment_thai_text(text):
         except Exception as e:
             print(f"DEBUG: Tokenizer '{engine}' not available: {e}", file=sys.stderr)
             continue
-    
+
     print(f"DEBUG: Using tokenizer engine: {selected_engine}", file=sys.stderr)
-    
+    _save_cached_engine(selected_engine)
+    _selected_engine = selected_engine
+    return _selected_engine
+
+def tokenize_words(sentence, engine):
+    """
+    Word-tokenize one sentence. With FAST_PATH, the sentence is split at
+    whitespace and only spans containing Thai script pay for PyThaiNLP;
+    Latin words, numbers and symbols are split with NON_THAI_TOKEN.
+    Whitespace is not returned in fast-path output. Only newmm has a fast path.
+    """
+    if not FAST_PATH or engine != "newmm":
+        return word_tokenize(sentence, engine=engine)
+
+    words = []
+    for match in SPAN.finditer(sentence):
+        span = match.group()
+        if THAI_CHAR.search(span):
+            words.extend(word_tokenize(span, engine=engine))
+        else:
+            words.extend(NON_THAI_TOKEN.findall(span))
+    return words
+
+def tokenize_sentences(text, engine=None):
+    """
+    Split text into sentences and each sentence into words, shared by
+    segment_thai_text() and analyze_thai_text(). Returns a list of
+    (sentence, words) pairs; words are stripped and never blank.
+    """
+    selected_engine = engine or select_engine()
+
     # Tokenize into sentences first
     try:
         sentences = sent_tokenize(text, engine=selected_engine)
@@ -38,52 +142,505 @@ def segment_thai_text(text):
         # Fallback to basic sentence splitting if sentence tokenizer fails
         sentences = text.split('\n')
 
-    segmented_sentences = []
+    tokenized = []
     for sentence in sentences:
         # Tokenize each sentence into words
         try:
-            words = word_tokenize(sentence, engine=selected_engine)
+            words = tokenize_words(sentence, selected_engine)
         except Exception as e:
             print(f"DEBUG: Word tokenization failed with {selected_engine}: {e}", file=sys.stderr)
             # Fallback to basic space-based tokenization for Thai
             words = sentence.split()
 
-        # Process words - keep ALL words but add spaces between them
-        processed_words = []
+        # Keep all meaningful words (don't filter stopwords for better searchability)
+        tokenized.append((sentence, [word.strip() for word in words if word.strip()]))
+    return tokenized
+
+def segment_thai_text(text, engine=None):
+    """
+    Segment Thai text using PythaiNLP
+    Returns segmented text with proper word boundaries
+    """
+    # Join words with single spaces for proper segmentation, and sentences with newlines
+    segmented_sentences = [' '.join(words) for _, words in tokenize_sentences(text, engine) if words]
+    return '\n'.join(segmented_sentences)
+
+def analyze_thai_text(text, engine=None):
+    """
+    Structured variant of segment_thai_text for the keyword indexer.
+    Returns {"segmented_text", "tokens", "sentences"} where every token is
+    {"text", "start", "end", "sentence"} and every sentence is {"start", "end"},
+    with character offsets into `text`. segmented_text matches segment_thai_text().
+    """
+    tokens = []
+    sentence_spans = []
+    segmented_sentences = []
+    cursor = 0
+    for sentence, words in tokenize_sentences(text, engine):
+        # Tokenizers may drop whitespace, so locate each piece in the original text
+        sentence_start = text.find(sentence, cursor)
+        if sentence_start < 0:
+            sentence_start = cursor
+        position = sentence_start
+
+        sentence_tokens = []
         for word in words:
-            word = word.strip()
-            # Keep all meaningful words (don't filter stopwords for better searchability)
-            if len(word) > 0 and not word.isspace():
-                processed_words.append(word)
+            start = text.find(word, position)
+            if start < 0:
+                start = position
+            end = start + len(word)
+            position = end
+            sentence_tokens.append({"text": word, "start": start, "end": end, "sentence": len(sentence_spans)})
 
-        # Join words with single spaces for proper segmentation
-        segmented_sentence = ' '.join(processed_words)
-        if segmented_sentence.strip():
-            segmented_sentences.append(segmented_sentence)
+        cursor = max(position, sentence_start + len(sentence))
+        if sentence_tokens:
+            sentence_spans.append({"start": sentence_tokens[0]["start"], "end": sentence_tokens[-1]["end"]})
+            tokens.extend(sentence_tokens)
+            segmented_sentences.append(' '.join(token["text"] for token in sentence_tokens))
 
-    # Join sentences back together with newlines preserved
-    result = '\n'.join(segmented_sentences)
-    return result
+    return {
+        "segmented_text": '\n'.join(segmented_sentences),
+        "tokens": tokens,
+        "sentences": sentence_spans
+    }
+
+_stopwords = None
+
+def mark_stopwords(tokens):
+    """Add a "stopword" flag to each token using PyThaiNLP's thai_stopwords()"""
+    global _stopwords
+    if _stopwords is None:
+        _stopwords = thai_stopwords()
+    for token in tokens:
+        token["stopword"] = token["text"] in _stopwords
+    return tokens
+
+class SegmentationCache:
+    """
+    On-disk cache of segmentation results keyed by sha256(text, engine, PyThaiNLP version)
+    plus the output variant and whether FAST_PATH was used.
+    Entries are evicted least-recently-used once the store exceeds max_entries,
+    checked when the cache is opened and then every EVICT_EVERY inserts, so
+    short-lived processes (one-shot CLI runs, small batches, pool workers) keep
+    the store bounded too. Each process (including pool workers) opens its own connection.
+    """
+
+    # Check the size bound every N inserts instead of on every insert
+    EVICT_EVERY = 100
+
+    def __init__(self, path, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._inserts = 0
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS segments ("
+            "  key TEXT PRIMARY KEY,"
+            "  segmented_text TEXT NOT NULL,"
+            "  last_used REAL NOT NULL"
+            ")"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS segments_last_used ON segments (last_used)")
+        self.evict()
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(text, engine, variant="text"):
+        digest = hashlib.sha256()
+        # "fast-spans" replaced the script-run fast path, whose entries split abbreviations
+        tokenizer = "fast-spans" if FAST_PATH and engine == "newmm" else "full"
+        for part in (pythainlp.__version__, engine, tokenizer, variant, text):
+            digest.update(part.encode('utf-8'))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key):
+        row = self.conn.execute("SELECT segmented_text FROM segments WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute("UPDATE segments SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.conn.commit()
+        return row[0]
+
+    def put(self, key, segmented_text):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO segments (key, segmented_text, last_used) VALUES (?, ?, ?)",
+            (key, segmented_text, time.time())
+        )
+        self._inserts += 1
+        if self._inserts % self.EVICT_EVERY == 0:
+            self.evict()
+        self.conn.commit()
+
+    def evict(self):
+        """Drop the least recently used entries beyond max_entries"""
+        count = self.conn.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM segments WHERE key IN "
+                "(SELECT key FROM segments ORDER BY last_used ASC LIMIT ?)",
+                (excess,)
+            )
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+_result_cache = None
+_result_cache_pid = None
+
+def get_result_cache():
+    """Return this process's SegmentationCache, or None if caching is disabled or unavailable"""
+    global _result_cache, _result_cache_pid
+
+    if RESULT_CACHE_PATH.lower() in ("", "off", "0", "false", "none"):
+        return None
+
+    # Pool workers must not share the parent's sqlite connection
+    if _result_cache_pid != os.getpid():
+        _result_cache_pid = os.getpid()
+        try:
+            _result_cache = SegmentationCache(RESULT_CACHE_PATH)
+        except Exception as e:
+            print(f"DEBUG: Segmentation cache unavailable ({RESULT_CACHE_PATH}): {e}", file=sys.stderr)
+            _result_cache = None
+    return _result_cache
+
+def _through_cache(key, compute):
+    """Return (value, cache_hit) for a string value, computing and storing it on a miss"""
+    cache = get_result_cache()
+    if cache is None:
+        return compute(), False
 
-if __name__ == "__main__":
     try:
-        # Read input from stdin and strip whitespace
-        input_text = sys.stdin.read().strip()
+        value = cache.get(key)
+    except sqlite3.Error as e:
+        print(f"DEBUG: Segmentation cache read failed: {e}", file=sys.stderr)
+        value = None
+    if value is not None:
+        return value, True
 
-        # Process the text
-        segmented_text = segment_thai_text(input_text)
+    value = compute()
+    try:
+        cache.put(key, value)
+    except sqlite3.Error as e:
+        print(f"DEBUG: Segmentation cache write failed: {e}", file=sys.stderr)
+    return value, False
 
-        # Debug logging
-        print(f"DEBUG SEGMENTED SAMPLE: {segmented_text[:300]}", file=sys.stderr)
+def cached_segment_thai_text(text, engine=None):
+    """
+    segment_thai_text() through the result cache.
+    Returns (segmented_text, cache_hit)
+    """
+    engine = engine or select_engine()
+    key = SegmentationCache.make_key(text, engine)
+    return _through_cache(key, lambda: segment_thai_text(text, engine))
+
+def cached_analyze_thai_text(text, engine=None):
+    """
+    analyze_thai_text() through the result cache.
+    Returns (analysis, cache_hit)
+    """
+    engine = engine or select_engine()
+    key = SegmentationCache.make_key(text, engine, variant="tokens")
+    value, cache_hit = _through_cache(
+        key, lambda: json.dumps(analyze_thai_text(text, engine), ensure_ascii=False)
+    )
+    return json.loads(value), cache_hit
+
+def strip_with_offset(text):
+    """Return (text.strip(), number of characters stripped from the front)"""
+    stripped = text.lstrip()
+    return stripped.rstrip(), len(text) - len(stripped)
+
+def _shift_spans(spans, offset):
+    """Copies of token/sentence dicts with start/end moved by `offset`"""
+    return [dict(span, start=span["start"] + offset, end=span["end"] + offset) for span in spans]
+
+def build_result(input_text, tokens=False, stopwords=False, offset=0):
+    """
+    Segment one text and wrap it in the JSON result shape expected by
+    server/services/thaiTextProcessor.ts. With tokens=True the result also
+    carries "tokens" and "sentences" with character offsets (see
+    analyze_thai_text), and stopwords=True flags stopword tokens. `offset` is
+    added to every offset, for callers that stripped leading whitespace from
+    the text they were sent (see strip_with_offset).
+    """
+    try:
+        if tokens or stopwords:
+            analysis, cache_hit = cached_analyze_thai_text(input_text)
+            segmented_text = analysis["segmented_text"]
+        else:
+            analysis = None
+            segmented_text, cache_hit = cached_segment_thai_text(input_text)
 
-        # Output as JSON
         result = {
             "success": True,
             "segmented_text": segmented_text,
             "original_length": len(input_text),
-            "segmented_length": len(segmented_text)
+            "segmented_length": len(segmented_text),
+            "cache_hit": cache_hit
+        }
+        if analysis is not None:
+            result["tokens"] = _shift_spans(mark_stopwords(analysis["tokens"]) if stopwords else analysis["tokens"], offset)
+            result["sentences"] = _shift_spans(analysis["sentences"], offset)
+        cache = get_result_cache()
+        if cache is not None:
+            result["cache"] = cache.stats()
+        return result
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "segmented_text": input_text
         }
 
+def segment_item(item, defaults=None):
+    """
+    Segment one {"id": ..., "text": "..."} item (server and batch modes).
+    Items may set "tokens"/"stopwords" to request structured output; `defaults`
+    supplies those flags when the item does not.
+    Returns the build_result() shape plus the echoed "id"; an item that is
+    not an object, or whose "text" is not a string, gets an error response
+    """
+    if isinstance(item, str):
+        item = {"text": item}
+    if not isinstance(item, dict):
+        return {"id": None, "success": False, "error": f"Request must be a JSON object, got {type(item).__name__}"}
+    defaults = defaults or {}
+
+    request_id = item.get("id")
+    if item.get("op") == "ping":
+        return {"id": request_id, "success": True, "pong": True}
+
+    text = item.get("text") or ""
+    if not isinstance(text, str):
+        return {"id": request_id, "success": False, "error": f'"text" must be a string, got {type(text).__name__}'}
+
+    # Offsets are reported against the text as sent, not the stripped copy
+    text, offset = strip_with_offset(text)
+    response = build_result(
+        text,
+        tokens=item.get("tokens", defaults.get("tokens", False)),
+        stopwords=item.get("stopwords", defaults.get("stopwords", False)),
+        offset=offset
+    )
+    response["id"] = request_id
+    return response
+
+def handle_request(line, defaults=None):
+    """
+    Handle one line-delimited JSON request from server mode.
+    Request:  {"id": ..., "text": "..."}  or  {"id": ..., "op": "ping"}
+    """
+    try:
+        request = json.loads(line)
+    except Exception as e:
+        return {"id": None, "success": False, "error": f"Invalid JSON request: {e}"}
+    # One bad request must not end the server loop with others still pending
+    try:
+        return segment_item(request, defaults)
+    except Exception as e:
+        request_id = request.get("id") if isinstance(request, dict) else None
+        return {"id": request_id, "success": False, "error": str(e)}
+
+def read_batch(stream):
+    """
+    Yield batch items from either a JSON array or JSONL of {"id", "text"}.
+    JSONL is read lazily so results can stream out while input is still arriving.
+    """
+    first_line = stream.readline()
+    while first_line and not first_line.strip():
+        first_line = stream.readline()
+    if not first_line:
+        return
+
+    if first_line.lstrip().startswith('['):
+        yield from json.loads(first_line + stream.read())
+        return
+
+    yield json.loads(first_line)
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+def _windows(items, size):
+    """Group an iterable into lists of at most `size` items"""
+    window = []
+    for item in items:
+        window.append(item)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+def segment_batch(items, workers=1, engine=None, defaults=None):
+    """
+    Segment many items and yield results in input order. With workers > 1
+    the items are fanned across a process pool, each worker loading the
+    tokenizer once. Input is consumed a bounded window at a time so a lazy
+    `items` iterator is never read far ahead of the output.
+    """
+    engine = select_engine(engine)
+
+    if workers <= 1:
+        for item in items:
+            yield segment_item(item, defaults)
+        return
+
+    with multiprocessing.Pool(workers, initializer=_warm_up, initargs=(engine,)) as pool:
+        for window in _windows(items, workers * BATCH_CHUNKSIZE * 4):
+            yield from pool.imap(partial(segment_item, defaults=defaults), window, chunksize=BATCH_CHUNKSIZE)
+
+def iter_paragraphs(stream, max_chars=STREAM_MAX_CHUNK_CHARS):
+    """
+    Read text incrementally and yield paragraphs (split on blank lines).
+    Paragraphs longer than max_chars are cut at the last whitespace, so memory
+    stays proportional to max_chars regardless of input size.
+    """
+    buffer = ""
+    while True:
+        line = stream.readline(max_chars)
+        if not line:
+            break
+
+        if not line.strip():
+            if buffer.strip():
+                yield buffer
+            buffer = ""
+            continue
+
+        buffer += line
+        while len(buffer) >= max_chars:
+            cut = max(buffer.rfind(" ", 0, max_chars), buffer.rfind("\n", 0, max_chars))
+            if cut <= 0:
+                cut = max_chars
+            yield buffer[:cut]
+            buffer = buffer[cut:]
+
+    if buffer.strip():
+        yield buffer
+
+def segment_stream(stream, workers=1, engine=None, defaults=None):
+    """
+    Streaming mode: segment stdin paragraph by paragraph and yield one JSONL
+    record per paragraph ({"id": index, ...} in the build_result() shape),
+    followed by a {"done": true, ...} summary record. Token offsets, when
+    requested, are relative to each paragraph.
+    """
+    items = ({"id": index, "text": paragraph} for index, paragraph in enumerate(iter_paragraphs(stream)))
+
+    chunks = 0
+    original_length = 0
+    segmented_length = 0
+    for response in segment_batch(items, workers=workers, engine=engine, defaults=defaults):
+        chunks += 1
+        original_length += response.get("original_length", 0)
+        segmented_length += response.get("segmented_length", 0)
+        yield response
+
+    yield {
+        "done": True,
+        "success": True,
+        "chunks": chunks,
+        "original_length": original_length,
+        "segmented_length": segmented_length
+    }
+
+def _warm_up(engine=None):
+    """Load the tokenizer dictionary once so the first request does not pay for it"""
+    select_engine(engine)
+    segment_thai_text("ทดสอบ")
+
+def serve(workers=1, engine=None, defaults=None):
+    """
+    Long-lived server mode: read one JSON request per line on stdin and write
+    one JSON response per line on stdout, in request order. The tokenizer is
+    loaded once per process instead of once per text.
+    """
+    lines = (line for line in iter(sys.stdin.readline, '') if line.strip())
+
+    def emit(response):
+        sys.stdout.write(json.dumps(response, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+
+    engine = select_engine(engine)
+
+    if workers <= 1:
+        _warm_up(engine)
+        print("DEBUG: Thai segmenter server ready (1 worker)", file=sys.stderr)
+        for line in lines:
+            emit(handle_request(line, defaults))
+        return
+
+    with multiprocessing.Pool(workers, initializer=_warm_up, initargs=(engine,)) as pool:
+        print(f"DEBUG: Thai segmenter server ready ({workers} workers)", file=sys.stderr)
+        for response in pool.imap(partial(handle_request, defaults=defaults), lines):
+            emit(response)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Segment Thai text with PyThaiNLP")
+    parser.add_argument("--serve", action="store_true",
+                        help="Run as a long-lived line-delimited JSON server on stdin/stdout")
+    parser.add_argument("--batch", action="store_true",
+                        help="Read a JSON array or JSONL of {id, text} and write JSONL results in order")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read plain text incrementally and write one JSONL result per paragraph")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes in server, batch and stream modes")
+    parser.add_argument("--tokens", action="store_true",
+                        help="Include tokens with character offsets and sentence boundaries in the output")
+    parser.add_argument("--stopwords", action="store_true",
+                        help="Include tokens and flag Thai stopwords among them (implies --tokens)")
+    parser.add_argument("--engine", choices=TOKENIZER_ENGINES,
+                        help="Tokenizer engine to use instead of probing (or set THAI_SEGMENTER_ENGINE)")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # Ensure proper UTF-8 encoding for stdin/stdout
+    sys.stdin = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+    if args.engine:
+        select_engine(args.engine)
+
+    defaults = {"tokens": args.tokens, "stopwords": args.stopwords}
+
+    if args.serve:
+        serve(workers=args.workers, engine=args.engine, defaults=defaults)
+        sys.exit(0)
+
+    if args.batch or args.stream:
+        if args.stream:
+            responses = segment_stream(sys.stdin, workers=args.workers, engine=args.engine, defaults=defaults)
+        else:
+            responses = segment_batch(read_batch(sys.stdin), workers=args.workers, engine=args.engine,
+                                      defaults=defaults)
+        for response in responses:
+            sys.stdout.write(json.dumps(response, ensure_ascii=False) + "\n")
+            sys.stdout.flush()
+        sys.exit(0)
+
+    try:
+        # Read input from stdin and strip whitespace; token offsets still point into the raw input
+        input_text, offset = strip_with_offset(sys.stdin.read())
+
+        # Process the text
+        result = build_result(input_text, tokens=args.tokens, stopwords=args.stopwords, offset=offset)
+
+        # Debug logging
+        print(f"DEBUG SEGMENTED SAMPLE: {result['segmented_text'][:300]}", file=sys.stderr)
+
+        # Output as JSON
         print(json.dumps(result, ensure_ascii=False))
 
     except Exception as e:
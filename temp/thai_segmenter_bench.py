@@ -0,0 +1,264 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+from datetime import datetime
+
+import thai_segmenter
+from thai_segmenter import TOKENIZER_ENGINES
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "thai_segmenter.py")
+DEFAULT_CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench", "thai_corpus.jsonl")
+MODES = ["cli", "batch", "daemon"]
+
+def load_corpus(path, repeat=1):
+    """
+    Load benchmark chunks from JSONL of {"id", "text"} or from plain text
+    (one chunk per blank-line separated paragraph)
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        raw = f.read()
+
+    if path.endswith(".jsonl"):
+        texts = [json.loads(line)["text"] for line in raw.splitlines() if line.strip()]
+    else:
+        texts = [p.strip() for p in raw.split("\n\n") if p.strip()]
+
+    return texts * repeat
+
+def percentile(values, pct):
+    """Nearest-rank percentile; values need not be sorted"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+def bench_env():
+    """Disable the result cache so every run measures real tokenization"""
+    env = dict(os.environ)
+    env["THAI_SEGMENTER_CACHE"] = "off"
+    env["PYTHONIOENCODING"] = "utf-8"
+    return env
+
+def run_process(args, input_text):
+    """Run the segmenter once; returns (stdout, seconds, peak_rss_kb)"""
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, SCRIPT_PATH] + args,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        env=bench_env()
+    )
+    proc.stdin.write(input_text.encode('utf-8'))
+    proc.stdin.close()
+    stdout = proc.stdout.read().decode('utf-8')
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+
+    if proc.returncode != 0:
+        raise RuntimeError(f"thai_segmenter.py {' '.join(args)} exited with code {proc.returncode}")
+    return stdout, elapsed, rusage.ru_maxrss
+
+def engine_available(engine):
+    """Probe an engine in a throwaway interpreter so heavy models never load into the harness"""
+    probe = f"from pythainlp import word_tokenize; word_tokenize('ทดสอบ', engine={engine!r})"
+    result = subprocess.run([sys.executable, "-c", probe],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode == 0
+
+def summarize(engine, mode, texts, latencies, segment_seconds, startup_seconds, peak_rss_kb, workers=1):
+    chars = sum(len(t) for t in texts)
+    return {
+        "engine": engine,
+        "mode": mode,
+        "workers": workers,
+        "chunks": len(texts),
+        "chars": chars,
+        "segment_seconds": round(segment_seconds, 6),
+        "chars_per_sec": round(chars / segment_seconds, 1) if segment_seconds > 0 else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+            "p95": round(percentile(latencies, 95) * 1000, 3) if latencies else None,
+        },
+        "startup_seconds": round(startup_seconds, 6),
+        "peak_rss_kb": peak_rss_kb,
+    }
+
+def bench_cli(engine, texts):
+    """One python3 process per chunk, as the original ThaiTextProcessor did"""
+    # A one-word input still forces the import and dictionary load that every run pays
+    _, startup_seconds, startup_rss = run_process(["--engine", engine], "ทดสอบ")
+
+    latencies = []
+    peak_rss_kb = startup_rss
+    for text in texts:
+        _, elapsed, rss = run_process(["--engine", engine], text)
+        latencies.append(elapsed)
+        peak_rss_kb = max(peak_rss_kb, rss)
+
+    return summarize(engine, "cli", texts, latencies, sum(latencies), startup_seconds, peak_rss_kb)
+
+def bench_batch(engine, texts, workers=1):
+    """
+    All chunks through one --batch process, behind a one-word warm-up item.
+    Startup is the time to the warm-up result and is left out of
+    segment_seconds, as in bench_daemon; latency is per chunk, from its
+    submit (or the end of startup, if later) to its result.
+    """
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, SCRIPT_PATH, "--batch", "--engine", engine, "--workers", str(workers)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        env=bench_env()
+    )
+    submitted = [None] * len(texts)
+
+    def feed():
+        # Forces the import, pool start and dictionary load, as in bench_cli
+        proc.stdin.write((json.dumps({"id": "startup", "text": "ทดสอบ"}, ensure_ascii=False) + "\n").encode('utf-8'))
+        for index, text in enumerate(texts):
+            submitted[index] = time.perf_counter()
+            proc.stdin.write((json.dumps({"id": index, "text": text}, ensure_ascii=False) + "\n").encode('utf-8'))
+        proc.stdin.close()
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+
+    arrivals = {}
+    for line in proc.stdout:
+        if line.strip():
+            arrivals[json.loads(line)["id"]] = time.perf_counter()
+    feeder.join()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    ready = arrivals.pop("startup", None)
+    if proc.returncode != 0 or ready is None or len(arrivals) != len(texts):
+        raise RuntimeError(f"--batch run for {engine} failed (exit {proc.returncode}, {len(arrivals)}/{len(texts)} results)")
+
+    latencies = [arrivals[index] - max(submitted[index], ready) for index in range(len(texts))]
+    return summarize(engine, "batch", texts, latencies, max(arrivals.values()) - ready, ready - start,
+                     rusage.ru_maxrss, workers=workers)
+
+def bench_daemon(engine, texts, workers=1):
+    """One --serve process; startup is time to the first pong, latency is per request round trip"""
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, SCRIPT_PATH, "--serve", "--engine", engine, "--workers", str(workers)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        env=bench_env()
+    )
+
+    def request(payload):
+        proc.stdin.write((json.dumps(payload, ensure_ascii=False) + "\n").encode('utf-8'))
+        proc.stdin.flush()
+        line = proc.stdout.readline()
+        if not line:
+            raise RuntimeError(f"--serve process for {engine} exited early")
+        return json.loads(line)
+
+    request({"id": "startup", "op": "ping"})
+    startup_seconds = time.perf_counter() - start
+
+    latencies = []
+    for index, text in enumerate(texts):
+        sent = time.perf_counter()
+        request({"id": index, "text": text})
+        latencies.append(time.perf_counter() - sent)
+
+    proc.stdin.close()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return summarize(engine, "daemon", texts, latencies, sum(latencies), startup_seconds,
+                     rusage.ru_maxrss, workers=workers)
+
+def check_fast_path(engine, texts):
+    """
+    Segment every chunk in-process with the fast path on and off; returns the
+    chunks whose segmented text differs (empty when the fast path is lossless)
+    """
+    saved = thai_segmenter.FAST_PATH
+    mismatches = []
+    try:
+        for index, text in enumerate(texts):
+            thai_segmenter.FAST_PATH = True
+            fast = thai_segmenter.segment_thai_text(text, engine=engine)
+            thai_segmenter.FAST_PATH = False
+            full = thai_segmenter.segment_thai_text(text, engine=engine)
+            if fast != full:
+                mismatches.append({"chunk": index, "fast": fast, "full": full})
+    finally:
+        thai_segmenter.FAST_PATH = saved
+    return mismatches
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark thai_segmenter.py engines and modes")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS_PATH,
+                        help="JSONL of {id, text} or plain text with blank-line separated chunks")
+    parser.add_argument("--repeat", type=int, default=1, help="Repeat the corpus N times")
+    parser.add_argument("--engines", default=",".join(TOKENIZER_ENGINES),
+                        help="Comma-separated engines to try; unavailable ones are skipped")
+    parser.add_argument("--modes", default=",".join(MODES), help="Comma-separated subset of cli,batch,daemon")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for batch and daemon modes")
+    parser.add_argument("--cli-chunks", type=int, default=10,
+                        help="Chunks to run in cli mode (one process each, so keep this small)")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--check-fast-path", action="store_true",
+                        help="Only verify fast-path output equals full PyThaiNLP output; exits 1 on any difference")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    texts = load_corpus(args.corpus, repeat=args.repeat)
+    modes = [m for m in args.modes.split(",") if m]
+
+    if args.check_fast_path:
+        failed = False
+        for engine in [e for e in args.engines.split(",") if e]:
+            if not engine_available(engine):
+                continue
+            mismatches = check_fast_path(engine, texts)
+            print(f"{engine}: {len(mismatches)}/{len(texts)} chunks differ")
+            for item in mismatches:
+                print(json.dumps(item, ensure_ascii=False))
+            failed = failed or bool(mismatches)
+        sys.exit(1 if failed else 0)
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "corpus": {"path": args.corpus, "chunks": len(texts), "chars": sum(len(t) for t in texts)},
+        "skipped_engines": [],
+        "results": [],
+    }
+
+    for engine in [e for e in args.engines.split(",") if e]:
+        if not engine_available(engine):
+            print(f"DEBUG: Skipping unavailable engine '{engine}'", file=sys.stderr)
+            report["skipped_engines"].append(engine)
+            continue
+
+        for mode in modes:
+            print(f"DEBUG: Benchmarking {engine} in {mode} mode", file=sys.stderr)
+            if mode == "cli":
+                result = bench_cli(engine, texts[:args.cli_chunks])
+            elif mode == "batch":
+                result = bench_batch(engine, texts, workers=args.workers)
+            elif mode == "daemon":
+                result = bench_daemon(engine, texts, workers=args.workers)
+            else:
+                raise ValueError(f"Unknown mode: {mode}")
+            report["results"].append(result)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()